@@ -5,6 +5,9 @@
 #Hostory:
 #2017/07/10         smile       First release
 
+import json
+import base64
+
 class APIError(Exception):
     def __init__(self,error,data='',message=''):
         super(APIError,self).__init__(message)
@@ -52,3 +55,39 @@ class Page(object):
         return 'item_count:%s,page_count:%s,page_index:%s,page_size:%s,offset:%s,limit:%s' % (self.item_count,self.page_count,self.page_index,self.page_size,self.offset,self.limit)
 
     __repr__ = __str__
+
+#游标编码：base64(json([direction,values]))
+#direction为'n'(下一页)或'p'(上一页)，values为该位置的keyset列值
+def encode_cursor(direction,values):
+    data = json.dumps([direction,list(values)],separators=(',',':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+#size: keyset的列数，values的个数必须与之相同且均为字符串或数字
+def decode_cursor(cursor,size=None):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction,values = json.loads(data.decode('utf-8'))
+    except Exception:
+        raise APIValueError('cursor','invalid cursor.')
+    if direction not in ('n','p') or not isinstance(values,list):
+        raise APIValueError('cursor','invalid cursor.')
+    if size is not None and len(values) != size:
+        raise APIValueError('cursor','invalid cursor.')
+    if not all(isinstance(v,(str,int,float)) and not isinstance(v,bool) for v in values):
+        raise APIValueError('cursor','invalid cursor.')
+    return direction,values
+
+#基于游标(keyset)的分页，不需要总数和OFFSET
+#next_cursor/previous_cursor为不透明的令牌，没有对应页时为None
+class CursorPage(object):
+    def __init__(self,page_size=10,next_cursor=None,previous_cursor=None):
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.has_next = next_cursor is not None
+        self.has_previous = previous_cursor is not None
+
+    def __str__(self):
+        return 'page_size:%s,next_cursor:%s,previous_cursor:%s' % (self.page_size,self.next_cursor,self.previous_cursor)
+
+    __repr__ = __str__
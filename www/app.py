@@ -1,27 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
-import logging;logging.basicConfig(level=logging.INFO)
+import re
+import logging
+import logs
+from config import configs
+#在导入其他模块之前设置日志，使导入时的日志也经过队列输出
+logs.setup(configs.logging.level,configs.logging.format)
 import asyncio
 import json
 import time
+import uuid
+import hashlib
 import os
+import signal
 import orm
-from config import configs
+import render
 from aiohttp import web
-from jinja2 import Environment,FileSystemLoader
+from jinja2 import Environment,FileSystemLoader,FileSystemBytecodeCache
 from coroweb import add_routes, add_static
 from handlers import cookie2user, COOKIE_NAME
+from cache import PageCache
+import assets
+import compress
 
+#production=True时：
+#   关闭auto_reload，不再每次get_template都检查模版文件
+#   使用FileSystemBytecodeCache，worker冷启动时不必重新编译
+#   启动时预编译全部模版，语法错误直接导致启动失败
 def init_jinja2(app,**kw):
     logging.info('init jinja2...')
+    production = kw.get('production',False)
     options = dict(
         autoescape = kw.get('autoescape',True),
         block_start_string = kw.get('block_start_string','{%'),
         block_end_string = kw.get('block_end_string','%}'),
         variable_start_string = kw.get('variable_start_string','{{'),
         variable_end_string = kw.get('variable_end_string','}}'),
-        auto_reload = kw.get('auto_reload',True)
+        auto_reload = kw.get('auto_reload',not production)
     )
+    if production:
+        options['bytecode_cache'] = FileSystemBytecodeCache(kw.get('bytecode_cache_dir',None))
     path = kw.get('path',None)
     if path is None:
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'templates')
@@ -31,17 +49,161 @@ def init_jinja2(app,**kw):
     if filters is not None:
         for name,f in filters.items():
             env.filters[name] = f
+    env_globals = kw.get('globals',None)
+    if env_globals is not None:
+        env.globals.update(env_globals)
+    if production:
+        names = env.list_templates(extensions=['html'])
+        for name in names:
+            env.get_template(name)
+        logging.info('precompiled %s templates' % len(names))
+    #模版版本：处理函数提供的校验值(__etag__)与之组合，模版更新后旧ETag随之失效
+    #开发模式下模版随时可能修改，不使用处理函数提供的校验值
+    app['__template_version__'] = template_version(path) if production else None
     app['__templating__'] = env
 
+def template_version(path):
+    h = hashlib.sha1()
+    for root,dirs,files in sorted(os.walk(path)):
+        for f in sorted(files):
+            st = os.stat(os.path.join(root,f))
+            h.update(('%s/%s:%s:%s;' % (root,f,st.st_size,st.st_mtime)).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+#请求日志：为每个请求分配id，结束时记录状态码和耗时
+#该请求中的所有日志记录都带有request_id
+async def logger_factory(app,handler):
+    async def logger(request):
+        logs.request_id.set(request.headers.get('X-Request-Id') or uuid.uuid4().hex[:16])
+        start = time.time()
+        status = 500
+        try:
+            r = await handler(request)
+            status = getattr(r,'status',200)
+            return r
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            duration = round((time.time() - start) * 1000,3)
+            logging.info('%s %s %s %.1fms',request.method,request.path,status,duration,extra=dict(duration=duration))
+    return logger
+
+#统计进行中的请求数，停止时据此等待请求处理完毕
+async def inflight_factory(app,handler):
+    async def inflight(request):
+        app['__inflight__'] += 1
+        try:
+            return (await handler(request))
+        finally:
+            app['__inflight__'] -= 1
+    return inflight
+
+#为每个请求建立identity map，同一请求内重复的Model.find不再查询数据库
+async def identity_factory(app,handler):
+    async def identity(request):
+        with orm.identity_map() as imap:
+            request.__identity_map__ = imap
+            r = await handler(request)
+            logging.debug('identity map: %s',imap)
+            return r
+    return identity
+
+#匿名访问的整页缓存
+#未携带会话cookie的GET请求，且路径匹配configs.page_cache.paths时，
+#直接返回缓存的响应字节，跳过auth、SQL、Markdown和模版渲染
+_RE_CACHEABLE = [re.compile(p) for p in configs.page_cache.paths]
+
+def is_page_cacheable(request):
+    if request.method != 'GET' or request.cookies.get(COOKIE_NAME):
+        return False
+    for p in _RE_CACHEABLE:
+        if p.match(request.path):
+            return True
+    return False
+
+async def page_cache_factory(app,handler):
+    cache = app['__page_cache__']
+    async def page_cache(request):
+        if not is_page_cacheable(request):
+            return (await handler(request))
+        key = (request.path,request.query_string)
+        item = cache.get(key)
+        if item is not None:
+            body,content_type,etag,variants = item
+            if is_not_modified(request,etag):
+                return not_modified(etag)
+            resp = web.Response(body=body,headers={'Content-Type':content_type,'ETag':etag,'X-Cache':'HIT'})
+            resp.__variants__ = variants
+            return resp
+        generation = cache.generation(request.path)
+        r = await handler(request)
+        #只缓存不设置cookie的200响应；渲染期间该路径被清除时不缓存
+        #variants: 压缩后的响应体(编码 => bytes)，由compress_factory填充，与缓存项一同过期
+        purged = cache.generation(request.path) != generation
+        if not purged and type(r) is web.Response and r.status == 200 and isinstance(r.body,bytes) and not r.cookies:
+            variants = dict()
+            cache.set(key,(r.body,r.headers.get('Content-Type','text/html;charset=utf-8'),r.headers.get('ETag'),variants))
+            r.headers['X-Cache'] = 'MISS'
+            r.__variants__ = variants
+        return r
+    return page_cache
+
+#日志或评论修改后清除首页和对应日志页
+def init_page_cache(app):
+    cache = PageCache(configs.page_cache.size,configs.page_cache.ttl)
+    def on_blog_changed(action,blog):
+        cache.purge('/')
+        if blog is not None:
+            cache.purge('/blog/%s' % blog.id)
+    def on_comment_changed(action,comment):
+        if comment is not None:
+            cache.purge('/blog/%s' % comment.blog_id)
+    orm.add_listener('blogs',on_blog_changed)
+    orm.add_listener('comments',on_comment_changed)
+    app['__page_cache__'] = cache
+    return cache
+
+#响应压缩：按Accept-Encoding选择br或gzip
+#跳过小于min_size、非文本类型或已经编码过的响应体
+#压缩后ETag改为弱ETag(与nginx相同)，条件GET仍按弱比较命中
+async def compress_factory(app,handler):
+    async def compression(request):
+        r = await handler(request)
+        if type(r) is not web.Response or r.status != 200 or not isinstance(r.body,bytes):
+            return r
+        if 'Content-Encoding' in r.headers or not compress.is_compressible(r.content_type):
+            return r
+        r.headers.setdefault('Vary','Accept-Encoding')
+        if len(r.body) < configs.compression.min_size:
+            return r
+        encoding = compress.choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return r
+        #整页缓存的响应复用已压缩的结果
+        variants = getattr(r,'__variants__',None)
+        body = variants.get(encoding) if variants is not None else None
+        if body is None:
+            body = await compress.compress_async(r.body,encoding)
+            if variants is not None:
+                variants[encoding] = body
+        r.body = body
+        r.headers['Content-Encoding'] = encoding
+        etag = r.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            r.headers['ETag'] = 'W/' + etag
+        return r
+    return compression
+
 async def auth_factory(app,handler):
     async def auth(request):
-        logging.info('check user:%s %s' % (request.method,request.path))
+        logging.debug('check user:%s %s',request.method,request.path)
         request.__user__ = None
         cookie_str = request.cookies.get(COOKIE_NAME)
         if cookie_str:
             user = await cookie2user(cookie_str)
             if user:
-                logging.info('set current user: %s' % user.email)
+                logging.debug('set current user: %s',user.name)
                 request.__user__ = user
         #拦截'/manage/'链接，验证管理员身份
         if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
@@ -49,37 +211,99 @@ async def auth_factory(app,handler):
         return (await handler(request))
     return auth
 
+#Conditional GET
+#If-None-Match优先；只有未携带If-None-Match时才比较If-Modified-Since
+#ETag按弱比较，'W/"x"'与'"x"'视为相同
+def is_not_modified(request,etag=None,last_modified=None):
+    if request.method not in ('GET','HEAD'):
+        return False
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or _strip_weak(etag) in [_strip_weak(t) for t in tags]
+    if last_modified is not None and request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+def not_modified(etag=None,last_modified=None):
+    resp = web.Response(status=304)
+    if etag is not None:
+        resp.headers['ETag'] = etag
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    return resp
+
+#处理函数提供的校验值：
+#   __etag__: 数据的摘要，与模版版本、当前用户组合成弱ETag
+#   __last_modified__: 数据的最后修改时间(时间戳)
+#从r中移除，不参与JSON序列化和模版渲染
+def handler_validators(app,r):
+    etag = r.pop('__etag__',None)
+    last_modified = r.pop('__last_modified__',None)
+    template = r.get('__template__',None)
+    if template is not None and app.get('__template_version__') is None:
+        return None,None
+    if etag is not None:
+        parts = [etag,template,app.get('__template_version__')]
+        user = r.get('__user__',None)
+        if user is not None:
+            parts.append('%s:%s:%s:%s' % (user.id,user.name,user.image,user.admin))
+        etag = 'W/"%s"' % hashlib.sha1('|'.join(map(str,parts)).encode('utf-8')).hexdigest()
+    return etag,last_modified
+
+#为GET的200响应加上校验头，未提供ETag时按响应体计算强ETag
+def conditional(request,resp,etag=None,last_modified=None):
+    if request.method not in ('GET','HEAD') or resp.status != 200:
+        return resp
+    if etag is None:
+        etag = '"%s"' % hashlib.sha1(resp.body).hexdigest()
+    resp.headers['ETag'] = etag
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    if is_not_modified(request,etag,last_modified):
+        return not_modified(etag,last_modified)
+    return resp
+
 async def response_factory(app,handler):
     async def response(request):
-        logging.info('Response handler...')
+        logging.debug('Response handler...')
         r = await handler(request)
         
         if isinstance(r,web.StreamResponse):
             return r
 
         if isinstance(r,bytes):
-            resp = web.Response(body=r.encode('utf-8'))
+            resp = web.Response(body=r)
             resp.content_type = 'application/octet-stream'
-            return resp
+            return conditional(request,resp)
 
         if isinstance(r,str):
             if r.startswith('redirect'):
                 return web.HTTPFound(r[9:])
             resp = web.Response(body=r.encode('utf-8'))
             resp.content_type = 'text/html;charset=utf-8'
-            return resp
+            return conditional(request,resp)
 
         if isinstance(r,dict):
             template = r.get('__template__',None)
+            etag,last_modified = handler_validators(app,r)
+            #处理函数提供了校验值时，在序列化/渲染之前判断是否可以返回304
+            if (etag is not None or last_modified is not None) and is_not_modified(request,etag,last_modified):
+                return not_modified(etag,last_modified)
             #如果不是渲染模版，序列化JSON Response
             if template is None:
                 resp = web.Response(body=json.dumps(r,ensure_ascii=False,default=lambda o:o.__dict__).encode('utf-8'))
                 resp.content_type = 'application/json;charset=utf-8'
-                return resp
+                return conditional(request,resp,etag,last_modified)
             else:
                 resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
                 resp.content_type = 'text/html;charset=utf-8'
-                return resp
+                return conditional(request,resp,etag,last_modified)
 
         if isinstance(r,int) and r >= 100 and r <= 600:
             return web.Response(r)
@@ -109,16 +333,103 @@ def datetime_filter(t):
     dt = datetime.fromtimestamp(t)
     return u'%s年%s月%s日' % (da.year,dt.month,dt.day)
 
-async def init(loop):
+#选择事件循环实现，须在创建事件循环之前调用
+def install_loop(name):
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logging.warning('uvloop is not installed, using the default asyncio loop.')
+            return 'asyncio'
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return 'uvloop'
+    return 'asyncio'
+
+#sock: 已绑定的监听socket(多进程模式下由launcher创建)，为None时按configs.server绑定
+async def init(loop,sock=None):
     await orm.create_pool(loop=loop,**configs.database)
-    app = web.Application(loop=loop,middlewares=[auth_factory,response_factory])
-    init_jinja2(app,filters=dict(datetime=datetime_filter))
+    if configs.orm.query_cache.enabled:
+        orm.init_query_cache(configs.orm.query_cache.size,configs.orm.query_cache.ttl,configs.orm.query_cache.max_rows,configs.orm.query_cache.max_bytes)
+    if configs.orm.slow_query.enabled:
+        orm.init_slow_log(configs.orm.slow_query.threshold,configs.orm.slow_query.sample_rate,configs.orm.slow_query.explain)
+    if configs.orm.single_flight:
+        orm.init_single_flight()
+    middlewares = [auth_factory,response_factory]
+    if configs.orm.identity_map:
+        middlewares.insert(0,identity_factory)
+    #整页缓存命中时不需要identity map和auth
+    if configs.page_cache.enabled:
+        middlewares.insert(0,page_cache_factory)
+    #在整页缓存之外压缩，缓存命中时也能返回压缩后的响应
+    if configs.compression.enabled:
+        middlewares.insert(0,compress_factory)
+    middlewares.insert(0,logger_factory)
+    middlewares.insert(0,inflight_factory)
+    app = web.Application(loop=loop,middlewares=middlewares,client_max_size=configs.server.client_max_size)
+    app['__inflight__'] = 0
+    if configs.page_cache.enabled:
+        init_page_cache(app)
+    static = add_static(app,configs.static.max_age,assets.load_manifest(),compress.choose_encoding)
+    init_jinja2(app,filters=dict(datetime=datetime_filter),globals=dict(static_url=static.url),production=configs.templates.production,bytecode_cache_dir=configs.templates.bytecode_cache_dir)
+    #页面引用的静态文件URL随manifest改变，处理函数提供的ETag也须随之改变
+    if app['__template_version__'] is not None:
+        app['__template_version__'] += static.version
     add_routes(app,'handlers')
-    add_static(app)
-    srv = await loop.create_server(app.make_handler(),'127.0.0.1',8000)
-    logging.info('server started at http://127.0.0.1:8000...')
-    return srv
-
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
+    #access_log=None: logger_factory已为每个请求记录一行，关闭aiohttp自带的访问日志
+    handler = app.make_handler(keepalive_timeout=configs.server.keepalive_timeout,access_log=None)
+    if sock is None:
+        srv = await loop.create_server(handler,configs.server.host,configs.server.port,backlog=configs.server.backlog)
+        logging.info('server started at http://%s:%s...' % (configs.server.host,configs.server.port))
+    else:
+        #launcher创建的socket只bind未listen，create_server时才开始接受连接
+        srv = await loop.create_server(handler,sock=sock,backlog=configs.server.backlog)
+        logging.info('server started at http://%s:%s (pid %s)...' % (sock.getsockname()[0],sock.getsockname()[1],os.getpid()))
+    app['__server__'] = srv
+    app['__handler__'] = handler
+    return app
+
+#Graceful shutdown
+#1. 停止接受新连接
+#2. 等待进行中的请求完成，最多timeout秒
+#3. 关闭剩余连接、Markdown进程池和数据库连接池，写出队列中的日志
+async def shutdown(app,timeout=10.0):
+    deadline = time.time() + timeout
+    logging.info('shutting down, %s requests in flight...' % app['__inflight__'])
+    srv = app['__server__']
+    srv.close()
+    while app['__inflight__'] > 0 and time.time() < deadline:
+        await asyncio.sleep(0.1)
+    if app['__inflight__'] > 0:
+        logging.warning('%s requests still in flight after %ss' % (app['__inflight__'],timeout))
+    await app.shutdown()
+    await app['__handler__'].shutdown(max(deadline - time.time(),0))
+    await srv.wait_closed()
+    await app.cleanup()
+    render.shutdown()
+    compress.shutdown()
+    await orm.destory_pool()
+    logging.info('server stopped.')
+
+#Run the server until one of `signals` arrives, then shut down gracefully
+#sock: launcher创建的监听socket；signals: 触发停止的信号
+#timeout: 等待进行中请求的秒数，默认取configs.server.shutdown_timeout
+#ready: 初始化完成、开始监听后调用，launcher据此判断worker已就绪
+def run(sock=None,signals=(signal.SIGTERM,signal.SIGINT),timeout=None,ready=None):
+    logging.info('event loop: %s' % install_loop(configs.server.loop))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app = loop.run_until_complete(init(loop,sock=sock))
+    if ready is not None:
+        ready()
+    stopping = asyncio.Event()
+    for sig in signals:
+        loop.add_signal_handler(sig,stopping.set)
+    try:
+        loop.run_until_complete(stopping.wait())
+        loop.run_until_complete(shutdown(app,configs.server.shutdown_timeout if timeout is None else timeout))
+    finally:
+        loop.close()
+        logs.shutdown()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Build fingerprinted static assets.
+#       Every file under static/ is copied to static/dist/ with a content
+#       hash in its name (css/uikit.min.css => css/uikit.min.1a2b3c4d5e.css),
+#       together with .gz and .br siblings. static/dist/manifest.json maps
+#       logical names to the hashed names; app.init loads it with
+#       load_manifest() and coroweb.add_static serves the hashed files with
+#       Cache-Control: immutable.
+#       url() references inside CSS are rewritten to the hashed names.
+#Usage:
+#       python3 assets.py [--clean]
+#       --clean   remove static/dist before building
+#History:
+#2026/10/18         First release
+
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'static')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+#生成压缩副本的扩展名，图片和woff本身已压缩
+_COMPRESSIBLE = ('.css','.js','.json','.svg','.txt','.html','.ttf','.otf','.eot')
+
+_RE_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_RE_URL_SUFFIX = re.compile(r'([^?#]*)(.*)')
+
+def hashed_name(name,data):
+    root,ext = os.path.splitext(name)
+    return '%s.%s%s' % (root,hashlib.sha1(data).hexdigest()[:10],ext)
+
+#把CSS中指向其他静态文件的相对url()改为哈希后的文件名，保留?query和#fragment
+def rewrite_css(name,data,manifest):
+    base = os.path.dirname(name)
+    def replace(m):
+        quote,url = m.group(1),m.group(2).strip()
+        if url.startswith(('data:','http:','https:','//','/')):
+            return m.group(0)
+        path,suffix = _RE_URL_SUFFIX.match(url).groups()
+        target = os.path.normpath(os.path.join(base,path)).replace(os.sep,'/')
+        if target not in manifest:
+            return m.group(0)
+        rel = os.path.relpath(manifest[target],base or '.').replace(os.sep,'/')
+        return 'url(%s%s%s%s)' % (quote,rel,suffix,quote)
+    return _RE_CSS_URL.sub(replace,data.decode('utf-8')).encode('utf-8')
+
+def write(path,data):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path,'wb') as f:
+        f.write(data)
+
+#只保留比原文件小的压缩副本
+def write_compressed(path,data):
+    variants = [('.gz',gzip.compress(data,compresslevel=9))]
+    if brotli is not None:
+        variants.append(('.br',brotli.compress(data,quality=11)))
+    for ext,body in variants:
+        if len(body) < len(data):
+            write(path + ext,body)
+
+#返回static/下需要处理的文件(逻辑名)，CSS排在最后，使其引用的文件先得到哈希名
+def source_files(src):
+    names = []
+    for root,dirs,files in os.walk(src):
+        if root == src:
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        for f in files:
+            if f == 'README':
+                continue
+            names.append(os.path.relpath(os.path.join(root,f),src).replace(os.sep,'/'))
+    return sorted(names,key=lambda n:(n.endswith('.css'),n))
+
+def build(src=STATIC_PATH):
+    dest = os.path.join(src,DIST_DIR)
+    manifest = dict()
+    for name in source_files(src):
+        with open(os.path.join(src,name),'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = rewrite_css(name,data,manifest)
+        manifest[name] = hashed_name(name,data)
+        path = os.path.join(dest,manifest[name])
+        write(path,data)
+        if name.endswith(_COMPRESSIBLE):
+            write_compressed(path,data)
+        logging.info('%s => %s/%s' % (name,DIST_DIR,manifest[name]))
+    write(os.path.join(dest,MANIFEST),json.dumps(manifest,indent=2,sort_keys=True).encode('utf-8'))
+    logging.info('built %s assets, brotli %s' % (len(manifest),'enabled' if brotli is not None else 'not installed'))
+    return manifest
+
+#读取manifest，返回 逻辑名 => 相对static/的哈希文件名；未构建时返回空dict
+def load_manifest(src=STATIC_PATH):
+    path = os.path.join(src,DIST_DIR,MANIFEST)
+    if not os.path.isfile(path):
+        logging.warning('%s not found, run assets.py to build fingerprinted assets' % path)
+        return dict()
+    with open(path,'r',encoding='utf-8') as f:
+        return dict((k,'%s/%s' % (DIST_DIR,v)) for k,v in json.load(f).items())
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Build fingerprinted and precompressed static assets.')
+    parser.add_argument('--clean',action='store_true',help='remove static/%s before building' % DIST_DIR)
+    args = parser.parse_args(argv)
+    if args.clean:
+        shutil.rmtree(os.path.join(STATIC_PATH,DIST_DIR),ignore_errors=True)
+    build()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
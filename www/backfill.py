@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Render Markdown for existing blogs and store it in html_content.
+#Usage:
+#       python3 backfill.py [--batch-size 100] [--all]
+#History:
+#2026/10/18         First release
+
+import sys
+import logging;logging.basicConfig(level=logging.INFO)
+import asyncio
+import argparse
+import contextlib
+import orm
+import render
+from config import configs
+from models import Blog
+
+#只处理尚未渲染的日志
+#每批更新后这些行不再满足条件，因此总是读取第一批
+async def backfill_missing(batch_size):
+    total = 0
+    while True:
+        blogs = await Blog.findAll('`html_content` is null',orderby='`id`',limit=batch_size)
+        if not blogs:
+            break
+        for blog in blogs:
+            blog.html_content = await render.render_markdown(blog.content)
+            await blog.update()
+        total = total + len(blogs)
+        logging.info('rendered %s blogs' % total)
+    return total
+
+#重新渲染全部日志，例如升级markdown2或修改extras之后
+#使用流式游标遍历，不把整张表读入内存
+async def backfill_all(batch_size):
+    total = 0
+    async with contextlib.aclosing(Blog.iterate(batch_size=batch_size)) as blogs:
+        async for blog in blogs:
+            blog.html_content = await render.render_markdown(blog.content)
+            await blog.update()
+            total = total + 1
+            if total % batch_size == 0:
+                logging.info('rendered %s blogs' % total)
+    return total
+
+async def main(loop,argv):
+    parser = argparse.ArgumentParser(description='Render Markdown of existing blogs into html_content.')
+    parser.add_argument('--batch-size',type=int,default=100,help='rows rendered per batch')
+    parser.add_argument('--all',action='store_true',help='re-render every blog, not only missing ones')
+    args = parser.parse_args(argv)
+
+    await orm.create_pool(loop=loop,**configs.database)
+    try:
+        if args.all:
+            total = await backfill_all(args.batch_size)
+        else:
+            total = await backfill_missing(args.batch_size)
+        logging.info('backfill done: %s blogs' % total)
+    finally:
+        render.shutdown()
+        await orm.destory_pool()
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(loop,sys.argv[1:]))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Small in-process caches shared by the web app
+#History:
+#2026/10/18         First release
+
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+#LRU cache
+#超过maxsize时淘汰最久未使用的条目
+#maxbytes: 可选的内存预算，set时由调用方给出条目的估计字节数，总量超出时同样按LRU淘汰
+class LRUCache(object):
+    def __init__(self,maxsize=128,maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = dict()
+
+    def get(self,key,default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    #单个条目超过maxbytes时不缓存
+    def set(self,key,value,nbytes=0):
+        self._remove(key)
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            return
+        self._data[key] = value
+        if nbytes:
+            self._sizes[key] = nbytes
+            self.bytes += nbytes
+        while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+            self._remove(next(iter(self._data)))
+
+    def _remove(self,key):
+        self.bytes -= self._sizes.pop(key,0)
+        return self._data.pop(key,_MISSING)
+
+    def pop(self,key,default=None):
+        value = self._remove(key)
+        return default if value is _MISSING else value
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def __contains__(self,key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __str__(self):
+        return '<%s size:%s/%s bytes:%s/%s hits:%s misses:%s>' % (self.__class__.__name__,len(self._data),self.maxsize,self.bytes,self.maxbytes,self.hits,self.misses)
+
+    __repr__ = __str__
+
+#LRU cache with expiry
+#条目在ttl秒后过期，读取时惰性删除
+class TTLCache(LRUCache):
+    def __init__(self,maxsize=128,ttl=60,maxbytes=None):
+        super(TTLCache,self).__init__(maxsize,maxbytes)
+        self.ttl = ttl
+
+    def get(self,key,default=None):
+        item = self._data.get(key)
+        if item is not None and item[1] < time.time():
+            self._remove(key)
+            item = None
+        if item is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self,key,value,ttl=None,nbytes=0):
+        super(TTLCache,self).set(key,(value,time.time() + (self.ttl if ttl is None else ttl)),nbytes)
+
+    def pop(self,key,default=None):
+        item = self._remove(key)
+        return default if item is _MISSING else item[0]
+
+    def __contains__(self,key):
+        item = self._data.get(key)
+        return item is not None and item[1] >= time.time()
+
+#Full-page cache
+#键为(path,query_string)，值为(body,content_type)
+#每个路径有一个代数，purge时加一：
+#渲染前取得代数，渲染期间该路径被清除时不再放入缓存，避免写入前渲染的旧页面覆盖清除
+class PageCache(TTLCache):
+    def __init__(self,maxsize=128,ttl=60,maxbytes=None):
+        super(PageCache,self).__init__(maxsize,ttl,maxbytes)
+        self._generations = dict()
+
+    def generation(self,path):
+        return self._generations.get(path,0)
+
+    #清除某路径的所有查询参数变体
+    def purge(self,path):
+        self._generations[path] = self._generations.get(path,0) + 1
+        n = 0
+        for key in self.keys():
+            if key[0] == path:
+                self._remove(key)
+                n += 1
+        return n
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Response compression: gzip, and brotli when the brotli package is
+#       installed. Encodings are negotiated from Accept-Encoding; large
+#       bodies are compressed in a thread pool so the event loop is not
+#       blocked.
+#History:
+#2026/10/18         First release
+
+import gzip
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from config import configs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#按优先顺序排列的可用编码
+ENCODINGS = ('br','gzip') if brotli is not None else ('gzip',)
+
+#值得压缩的内容类型，图片、字体、压缩包等本身已压缩
+_COMPRESSIBLE = ('text/','application/json','application/javascript','application/xml','image/svg+xml')
+
+_executor = None
+
+def is_compressible(content_type):
+    return content_type is not None and content_type.startswith(_COMPRESSIBLE)
+
+#Choose an encoding from the Accept-Encoding header
+#q=0表示拒绝该编码；'*'匹配其他未列出的编码；返回None表示不压缩
+#encodings: 候选编码(按优先顺序)，默认为本机可用的ENCODINGS
+def choose_encoding(accept_encoding,encodings=None):
+    if not accept_encoding:
+        return None
+    accepted = dict()
+    for item in accept_encoding.split(','):
+        name,_,params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    best,best_q = None,0.0
+    for encoding in (ENCODINGS if encodings is None else encodings):
+        q = accepted.get(encoding,accepted.get('*',0.0))
+        if q > best_q:
+            best,best_q = encoding,q
+    return best
+
+def compress(data,encoding):
+    if encoding == 'br':
+        return brotli.compress(data,quality=configs.compression.brotli_quality)
+    if encoding == 'gzip':
+        return gzip.compress(data,compresslevel=configs.compression.gzip_level)
+    raise ValueError('unsupported encoding: %s' % encoding)
+
+#线程池在第一次使用时创建；zlib和brotli在压缩时释放GIL
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=configs.compression.workers or None)
+    return _executor
+
+#Compress (async)
+#小于thread_min_size的数据直接在当前线程压缩，避免线程切换的开销
+async def compress_async(data,encoding):
+    if len(data) < configs.compression.thread_min_size:
+        return compress(data,encoding)
+    loop = asyncio.get_event_loop()
+    return (await loop.run_in_executor(_get_executor(),compress,data,encoding))
+
+#关闭线程池
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
@@ -5,14 +5,120 @@
 #Hostory:
 #2017/07/07         smile       First release
 configs = {
+    'server':{
+        #事件循环实现：uvloop(未安装时回退到asyncio)或asyncio
+        'loop':'uvloop',
+        'host':'127.0.0.1',
+        'port':8000,
+        'backlog':128,
+        #keep-alive连接的空闲超时秒数
+        'keepalive_timeout':75,
+        #请求体最大字节数
+        'client_max_size':1024 * 1024,
+        #launcher.py的worker进程数，None为CPU核数
+        'workers':None,
+        #停止时等待进行中请求的秒数
+        'shutdown_timeout':10.0
+    },
+    'templates':{
+        #生产模式：关闭auto_reload，启用字节码缓存并在启动时预编译模版
+        'production':False,
+        #字节码缓存目录，None为系统临时目录
+        'bytecode_cache_dir':None
+    },
+    'logging':{
+        'level':'INFO',
+        #text或json
+        'format':'text'
+    },
     'database':{
         'host':'127.0.0.1',
         'port':3306,
         'user':'www-data',
         'password':'www-data',
-        'db':'awesome'
+        'db':'awesome',
+        #只读副本，如[{'host':'10.0.0.2'},{'host':'10.0.0.3'}]
+        'replicas':[],
+        #round_robin或least_busy
+        'replica_policy':'round_robin',
+        #写入某表后的秒数内，该表的读取仍走主库
+        #只在同一进程内有效，多worker时其他进程不知道这次写入
+        'read_your_writes':5,
+        #等待空闲连接的最长秒数，None为一直等待
+        'acquire_timeout':None
+    },
+    'orm':{
+        #按请求启用identity map(默认关闭)
+        #启用后同一请求内find/findAll返回共享的实例，修改结果前须先复制
+        'identity_map':False,
+        #Model.findAll(cache=True)使用的查询缓存
+        'query_cache':{
+            'enabled':True,
+            'size':1000,
+            'ttl':10,
+            #超过该行数的结果不缓存
+            'max_rows':1000,
+            #缓存结果的估计总字节数上限
+            'max_bytes':32 * 1024 * 1024
+        },
+        #慢查询日志
+        'slow_query':{
+            'enabled':True,
+            #超过该秒数记录
+            'threshold':0.1,
+            #记录的抽样比例
+            'sample_rate':1.0,
+            #每种语句形态执行一次EXPLAIN
+            'explain':True
+        },
+        #相同SQL和参数的并发查询只执行一次(事务外)
+        'single_flight':True
     },
     'session':{
-        'secret':'AwEsOme'
+        'secret':'AwEsOme',
+        #核对会话版本(口令是否已修改)的间隔秒数，0表示只在首次核对
+        'version_check':300,
+        'version_cache_size':10000,
+        #旧版cookie验证后缓存用户对象的秒数和最大条目数
+        'user_cache_ttl':60,
+        'user_cache_size':10000
+    },
+    'markdown':{
+        #渲染结果缓存的最大条目数
+        'cache_size':256,
+        #进程池大小，None为CPU核数
+        'workers':2,
+        #小于此长度(字符)的文本直接在事件循环中转换
+        'inline_max_size':16384
+    },
+    'page_cache':{
+        #匿名用户GET请求的整页缓存
+        'enabled':True,
+        'ttl':30,
+        'size':1000,
+        #可缓存的路径(正则)
+        'paths':[r'^/$',r'^/blog/[^/]+$']
+    },
+    'static':{
+        #未带内容哈希的静态文件的缓存秒数，0表示每次重新验证
+        #带哈希的文件(python3 assets.py生成)始终为immutable
+        'max_age':0
+    },
+    'compression':{
+        #按Accept-Encoding压缩响应(gzip；安装brotli后优先使用br)
+        'enabled':True,
+        #小于该字节数的响应体不压缩
+        'min_size':1024,
+        #超过该字节数时在线程池中压缩
+        'thread_min_size':65536,
+        'workers':2,
+        'gzip_level':6,
+        'brotli_quality':5
+    },
+    'counts':{
+        #缓存的表行数超过该秒数后重新校准
+        'max_age':60,
+        #使用information_schema的估计行数代替COUNT(*)
+        'estimate':False
     }
 }
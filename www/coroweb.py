@@ -8,13 +8,21 @@
 __author__ = 'smile'
 
 import os
+import json
+import hashlib
 import asyncio
+import mimetypes
 import inspect
 import functools
 import logging
+import logs
 from urllib import parse
-from aiohttp import web
+from aiohttp import web,hdrs
 from apis import APIError
+from singleflight import SingleFlight
+
+#预压缩副本：编码 => 扩展名，按优先顺序
+_PRECOMPRESSED = (('br','.br'),('gzip','.gz'))
 
 #编写装饰器，装饰URL处理函数
 #理由：如果只看一个URL处理函数，其和路径关系弱，要在后面特别指出。
@@ -42,6 +50,20 @@ def post(path):
         return wrapper
     return decorator
 
+#Coalesce identical concurrent calls
+#参数相同的并发请求共享同一次处理的结果，只适用于结果与当前用户无关的GET处理函数
+#用法：放在@get之下
+#   @get('/api/blogs')
+#   @coalesce
+#   async def api_blogs(*,page='1'): ...
+def coalesce(func):
+    flight = SingleFlight('handler.%s' % func.__name__)
+    @functools.wraps(func)
+    async def wrapper(**kw):
+        key = tuple(sorted((k,v) for k,v in kw.items() if k != 'request'))
+        return (await flight.do(key,func,**kw))
+    return wrapper
+
 #编写几个检测函数参数的函数
 #获取必须传入参数的命名关键字参数
 def get_required_kw_args(func):
@@ -160,7 +182,9 @@ class RequestHandler(object):
                 if not name in kw:
                     return web.HTTPBadRequest(text='Missing argument: %s' % name)
 
-        logging.info('call with args: %s' % str(kw))
+        logs.route.set(self._func.__name__)
+        #kw可能很大，只在DEBUG级别时才格式化
+        logging.debug('call with args: %s',kw)
         try:
             r = await self._func(**kw)
             return r
@@ -196,8 +220,53 @@ def add_routes(app,module_name):
             if method and path:
                 add_route(app,func)
 
+#静态文件
+#manifest: 逻辑名 => 带内容哈希的文件名(相对path)，这些文件内容永不改变，使用Cache-Control: immutable
+#其他文件每max_age秒重新验证
+#negotiate(accept_encoding,encodings): 从可用的预压缩编码中选择一个，返回None表示不压缩；
+#   未给出时不使用预压缩的.br/.gz副本
+class StaticFiles(object):
+    def __init__(self,path,prefix='/static/',max_age=0,manifest=None,negotiate=None):
+        self._path = os.path.realpath(path)
+        self._prefix = prefix
+        self._max_age = max_age
+        self._manifest = dict(manifest or ())
+        self._negotiate = negotiate
+        #manifest的摘要，重新构建后页面中的URL随之改变
+        self.version = hashlib.sha1(json.dumps(self._manifest,sort_keys=True).encode('utf-8')).hexdigest()[:16] if self._manifest else ''
+        self._hashed = set(self._manifest.values())
+
+    #Jinja全局函数static_url：逻辑名 => URL，未构建时返回原文件的URL
+    def url(self,name):
+        return self._prefix + self._manifest.get(name,name)
+
+    async def __call__(self,request):
+        filename = request.match_info['filename']
+        filepath = os.path.realpath(os.path.join(self._path,filename))
+        if not filepath.startswith(self._path + os.sep) or not os.path.isfile(filepath):
+            raise web.HTTPNotFound()
+        headers = dict()
+        if filename in self._hashed:
+            headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            headers['Cache-Control'] = 'public, max-age=%s' % self._max_age if self._max_age else 'no-cache'
+        available = [e for e,ext in _PRECOMPRESSED if os.path.isfile(filepath + ext)] if self._negotiate else None
+        if available:
+            headers['Vary'] = 'Accept-Encoding'
+            encoding = self._negotiate(request.headers.get(hdrs.ACCEPT_ENCODING),available)
+            if encoding is not None:
+                headers['Content-Type'] = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+                headers['Content-Encoding'] = encoding
+                filepath += dict(_PRECOMPRESSED)[encoding]
+        return web.FileResponse(filepath,headers=headers)
+
 #添加静态文件
-def add_static(app):
+#max_age,manifest,negotiate见StaticFiles
+def add_static(app,max_age=0,manifest=None,negotiate=None):
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'static')
-    app.router.add_static('/static/',path)
+    static = StaticFiles(path,'/static/',max_age,manifest,negotiate)
+    app.router.add_route('GET','/static/{filename:.+}',static)
+    app.router.add_route('HEAD','/static/{filename:.+}',static)
+    app['__static__'] = static
     logging.info('add static %s => %s' % ('/static/',path))
+    return static
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Cached per-table row counts for Page totals.
+#       Counts are adjusted in memory on Model.save/remove and reconciled
+#       against the database once they are older than max_age seconds.
+#History:
+#2026/10/18         First release
+
+import time
+import logging
+import orm
+from config import configs
+
+class RowCounter(object):
+    #max_age: 超过该秒数后重新从数据库校准
+    #estimate: True时使用information_schema中的行数估计值，代价更低但不精确
+    def __init__(self,max_age=60,estimate=False):
+        self.max_age = max_age
+        self.estimate = estimate
+        #table => [count,校准时间]
+        self._counts = dict()
+        self._reconciling = set()
+
+    def _on_change(self,table):
+        def callback(action,model):
+            entry = self._counts.get(table)
+            if entry is None:
+                return
+            if action == 'insert':
+                entry[0] += 1
+            elif action == 'delete':
+                entry[0] = max(entry[0] - 1,0)
+        return callback
+
+    async def _query(self,model):
+        if self.estimate:
+            rs = await orm.select('SELECT `TABLE_ROWS` _num_ FROM information_schema.`TABLES` WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = ?',[model.__table__],1)
+            return int(rs[0]['_num_'] or 0) if rs else 0
+        return await model.findNumber('count(*)')
+
+    async def reconcile(self,model):
+        table = model.__table__
+        self._reconciling.add(table)
+        try:
+            n = await self._query(model)
+        finally:
+            self._reconciling.discard(table)
+        if table not in self._counts:
+            orm.add_listener(table,self._on_change(table))
+        entry = self._counts.get(table)
+        if entry is not None and entry[0] != n:
+            logging.info('row count drift on %s: cached %s, actual %s' % (table,entry[0],n))
+        self._counts[table] = [n,time.time()]
+        return n
+
+    #返回model对应表的行数
+    #已有值过期时只由一个请求校准，其他请求继续使用旧值
+    async def count(self,model):
+        entry = self._counts.get(model.__table__)
+        if entry is None:
+            return await self.reconcile(model)
+        if time.time() - entry[1] > self.max_age and model.__table__ not in self._reconciling:
+            return await self.reconcile(model)
+        return entry[0]
+
+_counter = RowCounter(configs.counts.max_age,configs.counts.estimate)
+
+async def count(model):
+    return await _counter.count(model)
@@ -3,15 +3,21 @@
 import re
 import time
 import json
+import hmac
+import base64
 import hashlib
 import asyncio
-import markdown2
+import orm
+import render
+import counts
+import metrics
 import logging
 from models import Blog, User,Comment,next_id
-from coroweb import get,post
-from apis import APIError, APIValueError,APIPermissionError,APIResourceNotFoundError,Page
+from coroweb import get,post,coalesce
+from apis import APIError, APIValueError,APIPermissionError,APIResourceNotFoundError,Page,CursorPage,encode_cursor,decode_cursor
 from aiohttp import web
 from config import configs
+from cache import LRUCache,TTLCache
 
 #cookie name
 COOKIE_NAME = 'awesession'
@@ -34,22 +40,69 @@ def get_page_index(page_str):
         p = 1
     return p
 
+#列表按(created_at,id)倒序做seek分页
+_KEYSET = ('created_at','id')
+
+#日志列表查询的列：不含预渲染的html_content，列表页和API都不需要
+_BLOG_LIST_COLUMNS = ('id','user_id','user_name','user_image','name','summary','content','created_at')
+
+#按游标取一页，cursor为空字符串时取第一页
+#多取一条用于判断该方向是否还有数据
+#columns: 只查询这些列，须包含_KEYSET
+async def get_cursor_page(model,cursor,page_size=10,columns=None):
+    direction,values = decode_cursor(cursor,len(_KEYSET)) if cursor else ('n',None)
+    kw = dict(keyset=_KEYSET,limit=page_size + 1,columns=columns)
+    if values is not None:
+        kw['after' if direction == 'n' else 'before'] = values
+    items = await model.findAll(**kw)
+    more = len(items) > page_size
+    if direction == 'n':
+        items = items[:page_size]
+        has_next,has_previous = more,values is not None
+    else:
+        items = items[-page_size:]
+        has_next,has_previous = True,more
+    keys = lambda item:[item[k] for k in _KEYSET]
+    next_cursor = encode_cursor('n',keys(items[-1])) if items and has_next else None
+    previous_cursor = encode_cursor('p',keys(items[0])) if items and has_previous else None
+    return CursorPage(page_size,next_cursor,previous_cursor),items
+
+#页面数据的校验值(__etag__)，条件GET命中时跳过模版渲染
+#记录由id和created_at标识；日志可被编辑而created_at不变，因此按全部字段计算摘要
+def data_etag(*items):
+    h = hashlib.sha1()
+    for item in items:
+        for o in (item if isinstance(item,list) else [item]):
+            d = o if isinstance(o,dict) else vars(o)
+            h.update(repr(sorted(d.items())).encode('utf-8'))
+    return h.hexdigest()
+
 def text2html(text):
     lines = map(lambda s: '<p>%s</p>' % s.replace('&','&amp;').replace('>','&gt;'),filter(lambda s: s.strip() != '',text.split('\n')))
     return ''.join(lines)
 
 #--------------用户浏览页-------------------
 @get('/')
-async def index(request,*,page='1'):
+async def index(request,*,page='1',cursor=None):
+    if cursor is not None:
+        page,blogs = await get_cursor_page(Blog,cursor,columns=_BLOG_LIST_COLUMNS)
+        return {
+            '__template__':'blogs.html',
+            '__etag__':data_etag(page,blogs),
+            'page':page,
+            'blogs':blogs,
+            '__user__':request.__user__
+        }
     page_index = get_page_index(page)
-    num = await Blog.findNumber('count(id)')
+    num = await counts.count(Blog)
     page = Page(num,page_index)
     if num == 0:
         blogs = []
     else:
-        blogs = await Blog.findAll(orderBy='created_at desc',limit=(page.offset,page.limit))
+        blogs = await Blog.findAll(orderBy='created_at desc',limit=(page.offset,page.limit),columns=_BLOG_LIST_COLUMNS,cache=True)
     return {
         '__template__':'blogs.html',
+        '__etag__':data_etag(page,blogs),
         'page':page,
         'blogs':blogs,
         '__user__':request.__user__
@@ -83,46 +136,130 @@ def signout(request):
 async def get_blog(id,request):
     blog = await Blog.find(id)
     comments = await Comment.findAll('blog_id = ?',[id],orderBy='created_at desc')
+    etag = data_etag(blog,comments)
     for c in comments:
         c.html_content = text2html(c.content)
-    blog.html_content = markdown2.markdown(blog.content)
+    #旧数据尚未预渲染时回退到实时渲染
+    if blog.html_content is None:
+        blog.html_content = await render.render_markdown(blog.content)
     return {
         '__template__':'blog.html',
+        '__etag__':etag,
         'blog':blog,
         'comments':comments,
         '__user__':request.__user__
     }
 
-#cookie生成
+#会话cookie
 #方案：
+#payload = base64(json([id,name,image,admin,expires,version]))
+#cookie = payload + "." + HMAC-SHA256(payload,cookiekey)
+#cookie携带页面所需的用户字段，验证签名只需内存计算，不查询数据库
+#version由用户口令派生，修改口令后旧cookie随之失效
+def session_version(user):
+    return hmac.new(_COOKIE_KEY.encode('utf-8'),user.password.encode('utf-8'),hashlib.sha1).hexdigest()[:12]
+
+def _sign(payload):
+    return hmac.new(_COOKIE_KEY.encode('utf-8'),payload.encode('utf-8'),hashlib.sha256).hexdigest()
+
+#用户当前的会话版本：uid => (version,检查时间)
+_session_versions = LRUCache(configs.session.version_cache_size)
+
+#修改口令后调用，使本进程立即拒绝旧cookie
+def update_session_version(user):
+    _session_versions.set(user.id,(session_version(user),time.time()))
+
+#版本号未知或超过version_check秒未核对时，才查询一次数据库
+async def check_session_version(uid,version):
+    cached = _session_versions.get(uid)
+    interval = configs.session.version_check
+    if cached is None or (interval and time.time() - cached[1] > interval):
+        user = await User.find(uid)
+        if user is None:
+            _session_versions.pop(uid)
+            return False
+        update_session_version(user)
+        cached = _session_versions.get(uid)
+    return hmac.compare_digest(version,cached[0])
+
+#cookie生成
+def user2cookie(user,max_age):
+    expires = int(time.time() + max_age)
+    update_session_version(user)
+    data = json.dumps([user.id,user.name,user.image,bool(user.admin),expires,session_version(user)],ensure_ascii=False,separators=(',',':'))
+    payload = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+    return '%s.%s' % (payload,_sign(payload))
+
+#已验证用户的缓存：(uid,expires,sha1) => User
+#同一cookie在ttl秒内不再查询数据库
+_user_cache = TTLCache(configs.session.user_cache_size,configs.session.user_cache_ttl)
+
+#用户更新或删除后清除缓存
+def invalidate_user(uid):
+    for key in _user_cache.keys():
+        if key[0] == uid:
+            _user_cache.pop(key)
+    _session_versions.pop(uid)
+
+def _on_user_changed(action,user):
+    if user is not None:
+        invalidate_user(user.id)
+
+orm.add_listener(User.__table__,_on_user_changed)
+
+#旧版cookie验证
 #cookie = "userid" + "expires time" + SHA1("userid"+"userpassword"+
 #         "expires" + "cookiekey")
-def user2cookie(user,max_age):
-    expires = str(int(time.time() + max_age))
+#返回隐藏口令的副本
+#identity map中的实例在请求内共享，直接修改会使之后的口令校验失败
+def masked(user):
+    user = User(**user)
+    user.password = '******'
+    return user
+
+async def legacy_cookie2user(cookie_str):
+    L = cookie_str.split('-')
+    if len(L) != 3:
+        return None
+    uid,expires,sha1 = L
+    if int(expires) < time.time():
+        return None
+    key = (uid,expires,sha1)
+    user = _user_cache.get(key)
+    if user is not None:
+        return User(**user)
+    user = await User.find(uid)
+    if user is None:
+        return None
     s = '%s-%s-%s-%s' % (user.id,user.password,expires,_COOKIE_KEY)
-    L = [user.id,expires,hashlib.sha1(s.encode('utf-8')).hexdigest()]
-    return '-'.join(L)
+    if sha1 != hashlib.sha1(s.encode('utf-8')).hexdigest():
+        logging.info('invalid sha1')
+        return None
+    user = masked(user)
+    #缓存时间不超过cookie本身的有效期
+    _user_cache.set(key,User(**user),min(_user_cache.ttl,int(expires) - time.time()))
+    return user
 
 #cookie验证
 async def cookie2user(cookie_str):
     if not cookie_str:
         return None
     try:
-        L = cookie_str.split('-')
-        if len(L) != 3:
-            return None
-        uid,expires,sha1 = L
-        if int(expires) < time.time():
+        #不含"."的是旧版cookie
+        if '.' not in cookie_str:
+            return await legacy_cookie2user(cookie_str)
+        payload,sign = cookie_str.rsplit('.',1)
+        if not hmac.compare_digest(sign,_sign(payload)):
+            logging.info('invalid session signature')
             return None
-        user = await User.find(uid)
-        if user is None:
+        data = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+        uid,name,image,admin,expires,version = json.loads(data.decode('utf-8'))
+        if expires < time.time():
             return None
-        s = '%s-%s-%s-%s' % (user.id,user.password,expires,_COOKIE_KEY)
-        if sha1 != hashlib.sha1(s.encode('utf-8')).hexdigest():
-            logging.info('invalid sha1')
+        if not await check_session_version(uid,version):
+            logging.info('session version expired')
             return None
-        user.password = '******'
-        return user
+        return User(id=uid,name=name,image=image,admin=admin,password='******')
     except Exception as e:
         logging.exception(e)
         return None
@@ -151,9 +288,8 @@ async def api_user_register(*,name,email,passwd):
     await user.save()
     r = web.Response()
     r.set_cookie(COOKIE_NAME,user2cookie(user,86400),max_age=86400,httponly=True)
-    user.password = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user,ensure_ascii=False).encode('utf-8')
+    r.body = json.dumps(masked(user),ensure_ascii=False).encode('utf-8')
     return r
 
 #user sign in
@@ -172,12 +308,11 @@ async def authenticate(*,email,passwd):
     sha1.update(b':')
     sha1.update(passwd.encode('utf-8'))
     if user.password != sha1.hexdigest():
-        raise APIValue('password','Invalid password')
+        raise APIValueError('password','Invalid password')
     r = web.Response()
     r.set_cookie(COOKIE_NAME,user2cookie(user,86400),max_age=86400,httponly=True)
-    user.password = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user,ensure_ascii=False).encode('utf-8')
+    r.body = json.dumps(masked(user),ensure_ascii=False).encode('utf-8')
     return r
 
 def check_admin(request):
@@ -185,6 +320,7 @@ def check_admin(request):
         raise APIPermissionError()
 #获取日志
 @get('/api/blogs/{id}')
+@coalesce
 async def api_get_blog(*,id):
     blog = await Blog.find(id)
     return blog
@@ -200,20 +336,27 @@ async def api_create_blog(request,*,name,summary,content):
         raise APIValueError('content','content cannot be empty.')
 
     blog = Blog(user_id=request.__user__.id,user_name=request.__user__.name,user_image=request.__user__.image,name=name.strip(),summary=summary.strip(),content=content.strip())
+    #写入时渲染一次，读取时直接使用
+    blog.html_content = await render.render_markdown(blog.content)
     await blog.save()
     return blog
 
 @get('/api/blogs')
-async def api_blogs(*,page='1'):
+@coalesce
+async def api_blogs(*,page='1',cursor=None):
+    #传入cursor时使用游标分页，否则保持按页码分页
+    if cursor is not None:
+        p,blogs = await get_cursor_page(Blog,cursor,columns=_BLOG_LIST_COLUMNS)
+        return dict(page=p,blogs=blogs)
     #将request object中的字符串量转换为数字量
     page_index = get_page_index(page)
-    #获取博客总数
-    num = await Blog.findNumber('count(id)')
+    #获取博客总数(缓存值)
+    num = await counts.count(Blog)
     #获取指定页码页信息
     p = Page(num,page_index)
     if num == 0:
         return dict(page=p,blogs=())
-    blogs = await Blog.findAll(orderBy='created_at desc',limit=(p.offset,p.limit))
+    blogs = await Blog.findAll(orderBy='created_at desc',limit=(p.offset,p.limit),columns=_BLOG_LIST_COLUMNS)
     return dict(page=p,blogs=blogs)
 
 #更新日志
@@ -227,9 +370,11 @@ async def api_update_blog(id,request,*,name,summary,content):
         raise APIValueError('summary','summary cannot be empty.')
     if not content or not content.strip():
         raise APIValueError('content','content cannot be empty.')
+    render.invalidate(blog.content)
     blog.name = name.strip()
     blog.summary = summary.strip()
     blog.content = content.strip()
+    blog.html_content = await render.render_markdown(blog.content)
     await blog.update()
     return blog
 
@@ -239,26 +384,32 @@ async def api_delete_blog(request,*,id):
     check_admin(request)
     blog = await Blog.find(id)
     await blog.remove()
+    render.invalidate(blog.content)
     return dict(id=id)
 
 #获取用户
 @get('/api/users')
-async def api_get_users(*,page='1'):
+async def api_get_users(*,page='1',cursor=None):
+    if cursor is not None:
+        p,users = await get_cursor_page(User,cursor)
+        return dict(page=p,users=[masked(u) for u in users])
     page_index = get_page_index(page)
     num = await User.findNumber('count(id)')
     p = Page(num,page_index)
     if num == 0:
         return dict(page=p,users=())
     users = await User.findAll(orderBy='created_at desc',limit=(p.offset,p.limit))
-    for u in users:
-        u.password = '******'
-    return dict(page=p,users=users)
+    return dict(page=p,users=[masked(u) for u in users])
 
 #获取评论
 @get('/api/comments')
-async def api_comments(*,page='1'):
+@coalesce
+async def api_comments(*,page='1',cursor=None):
+    if cursor is not None:
+        p,comments = await get_cursor_page(Comment,cursor)
+        return dict(page=p,comments=comments)
     page_index = get_page_index(page)
-    num = await Comment.findNumber('count(id)')
+    num = await counts.count(Comment)
     p = Page(num,page_index)
     if num == 0:
         return dict(page=p,comments=())
@@ -290,6 +441,12 @@ async def api_delete_comments(id,request):
         raise APIResourceNotFoundError('Comment')
     await c.remove()
     return dict(id=id)
+#运行指标：连接池状态、等待时间、各类SQL的延迟
+@get('/api/metrics')
+def api_metrics(request):
+    check_admin(request)
+    return metrics.snapshot()
+
 #------------------后台管理------------------
 @get('/manage/')
 def manage():
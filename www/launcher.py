@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Prefork launcher: run N worker processes that share one port via
+#       SO_REUSEPORT. Each worker has its own event loop, orm pool and
+#       Jinja environment.
+#Usage:
+#       python3 launcher.py [--workers N] [--host HOST] [--port PORT]
+#       默认值取自configs.server
+#Signals (master):
+#       SIGTERM/SIGINT  graceful shutdown of all workers
+#       SIGHUP          graceful reload: start new workers, wait until they are
+#                       serving, then drain old ones
+#Notes:
+#       Worker向管道写入一个字节表示已完成初始化并开始监听，master据此判断就绪
+#       关闭监听socket时，其accept队列中尚未被接受的连接会被内核重置；
+#       Linux 5.14+可设置sysctl net.ipv4.tcp_migrate_req=1，使这些连接迁移到同组的其他监听socket
+#History:
+#2026/10/18         First release
+
+import os
+import sys
+import time
+import signal
+import select
+import socket
+import logging
+import argparse
+import logs
+from config import configs
+
+#连续启动失败时重启worker的等待秒数上限
+MAX_BACKOFF = 30
+#从未有worker就绪过时，连续失败该次数后放弃启动
+MAX_STARTUP_FAILURES = 5
+
+def log(s):
+    logging.info('[Master %s] %s' % (os.getpid(),s))
+
+#每个worker各自绑定同一端口，由内核在各进程间分配连接
+#此处只bind不listen：create_server在app初始化完成后才listen，
+#worker在就绪之前不会加入SO_REUSEPORT组，不会分到连接
+def bind_socket(host,port):
+    sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+    sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
+    sock.bind((host,port))
+    sock.setblocking(False)
+    return sock
+
+#Worker process
+#在fork之后才导入app，日志线程、连接池、Jinja环境都在子进程中创建
+#ready_fd: 开始监听后向其写入一个字节通知master
+def run_worker(host,port,timeout,ready_fd):
+    #Ctrl-C会发给整个进程组，由master统一处理
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    signal.signal(signal.SIGHUP,signal.SIG_IGN)
+    signal.signal(signal.SIGTERM,signal.SIG_DFL)
+    import app as webapp
+    def ready():
+        os.write(ready_fd,b'1')
+        os.close(ready_fd)
+    sock = bind_socket(host,port)
+    webapp.run(sock=sock,signals=(signal.SIGTERM,),timeout=timeout,ready=ready)
+
+class Master(object):
+    def __init__(self,host,port,workers,timeout):
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.timeout = timeout
+        #pid => generation
+        self.workers = dict()
+        #尚未就绪的worker：pid => 管道读端
+        self.pending = dict()
+        self.generation = 0
+        #reload时等待新一代就绪后再停止的旧worker
+        self.retiring = []
+        #连续未能就绪的worker数，以及下次允许启动worker的时间
+        self.failures = 0
+        self.next_spawn = 0
+        self.started = False
+        self._stopping = False
+        self._reloading = False
+
+    def spawn(self):
+        r,w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(r)
+                for fd in self.pending.values():
+                    os.close(fd)
+                run_worker(self.host,self.port,self.timeout,w)
+            except BaseException as e:
+                logging.exception(e)
+                code = 1
+            finally:
+                logs.shutdown()
+                logging.shutdown()
+                os._exit(code)
+        os.close(w)
+        self.workers[pid] = self.generation
+        self.pending[pid] = r
+        log('spawned worker %s (generation %s)' % (pid,self.generation))
+
+    #读取已就绪worker的通知；timeout秒内没有通知时返回
+    def wait_ready(self,timeout):
+        if not self.pending:
+            time.sleep(timeout)
+            return
+        fds = dict((fd,pid) for pid,fd in self.pending.items())
+        readable,_,_ = select.select(list(fds.keys()),[],[],timeout)
+        for fd in readable:
+            pid = fds[fd]
+            data = os.read(fd,1)
+            os.close(fd)
+            del self.pending[pid]
+            #管道在写入前关闭表示worker初始化失败
+            if data:
+                log('worker %s is ready' % pid)
+                self.failures = 0
+                self.started = True
+            else:
+                self.failed(pid)
+
+    #worker未就绪就退出，推迟下一次启动
+    def failed(self,pid):
+        if self.workers.get(pid) != self.generation or self._stopping:
+            return
+        self.failures += 1
+        delay = min(0.5 * 2 ** self.failures,MAX_BACKOFF)
+        self.next_spawn = time.time() + delay
+        log('worker %s failed before becoming ready (%s in a row), next start in %.1fs' % (pid,self.failures,delay))
+
+    def kill(self,pids,sig=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid,sig)
+            except ProcessLookupError:
+                self.workers.pop(pid,None)
+
+    #回收已退出的worker
+    def reap(self):
+        while True:
+            try:
+                pid,status = os.waitpid(-1,os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            fd = self.pending.pop(pid,None)
+            if fd is not None:
+                os.close(fd)
+                self.failed(pid)
+            generation = self.workers.pop(pid,None)
+            if generation is not None:
+                log('worker %s exited with status %s' % (pid,status))
+
+    #保持当前这一代worker的数量，连续失败时按指数退避
+    def maintain(self):
+        if time.time() < self.next_spawn:
+            return
+        current = [pid for pid,g in self.workers.items() if g == self.generation]
+        for i in range(self.num_workers - len(current)):
+            self.spawn()
+
+    #先启动新一代worker，待其全部就绪后再让旧worker处理完进行中的请求后退出
+    def reload(self):
+        self.retiring.extend(pid for pid in self.workers.keys() if pid not in self.retiring)
+        self.generation += 1
+        self.failures = 0
+        self.next_spawn = 0
+        log('reloading, generation %s' % self.generation)
+        self.maintain()
+
+    def retire(self):
+        if not self.retiring:
+            return
+        current = [pid for pid,g in self.workers.items() if g == self.generation and pid not in self.pending]
+        if len(current) < self.num_workers:
+            return
+        log('generation %s is ready, stopping %s old workers' % (self.generation,len(self.retiring)))
+        self.kill([pid for pid in self.retiring if pid in self.workers])
+        self.retiring = []
+
+    def stop(self):
+        log('stopping %s workers...' % len(self.workers))
+        self.kill(list(self.workers.keys()))
+        deadline = time.time() + self.timeout + 5
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if self.workers:
+            log('killing %s workers that did not exit in time' % len(self.workers))
+            self.kill(list(self.workers.keys()),signal.SIGKILL)
+            while self.workers:
+                self.reap()
+                time.sleep(0.1)
+
+    def _on_stop(self,signum,frame):
+        self._stopping = True
+
+    def _on_reload(self,signum,frame):
+        self._reloading = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM,self._on_stop)
+        signal.signal(signal.SIGINT,self._on_stop)
+        signal.signal(signal.SIGHUP,self._on_reload)
+        log('listening on %s:%s with %s workers' % (self.host,self.port,self.num_workers))
+        self.maintain()
+        while not self._stopping:
+            if self._reloading:
+                self._reloading = False
+                self.reload()
+            self.wait_ready(0.5)
+            self.reap()
+            self.retire()
+            if not self.started and self.failures >= MAX_STARTUP_FAILURES:
+                log('workers failed to start %s times in a row, giving up' % self.failures)
+                self.stop()
+                return 1
+            self.maintain()
+        self.stop()
+        log('bye.')
+        return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the web app with prefork workers.')
+    parser.add_argument('--workers',type=int,default=configs.server.workers or os.cpu_count() or 1,help='number of worker processes (default: CPU count)')
+    parser.add_argument('--host',default=configs.server.host)
+    parser.add_argument('--port',type=int,default=configs.server.port)
+    parser.add_argument('--timeout',type=float,default=configs.server.shutdown_timeout,help='seconds to drain in-flight requests on shutdown')
+    args = parser.parse_args(argv)
+    return Master(args.host,args.port,args.workers,args.timeout).run()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
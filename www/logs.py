@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Non-blocking logging for the web app.
+#       Records are put on a queue by a QueueHandler and written to stderr
+#       by a QueueListener thread, so the event loop never blocks on I/O.
+#       Every record carries request_id, route and duration fields.
+#History:
+#2026/10/18         First release
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import contextvars
+from logging.handlers import QueueHandler,QueueListener
+
+#当前请求的id和路由，由app/coroweb在处理请求时设置
+request_id = contextvars.ContextVar('request_id',default='-')
+route = contextvars.ContextVar('route',default='-')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s %(route)s] %(message)s'
+
+#在调用日志的线程中把上下文字段附加到record上
+class ContextFilter(logging.Filter):
+    def filter(self,record):
+        record.request_id = request_id.get()
+        record.route = route.get()
+        if not hasattr(record,'duration'):
+            record.duration = None
+        return True
+
+#每条记录输出一行JSON
+class JSONFormatter(logging.Formatter):
+    def format(self,record):
+        d = dict(time=self.formatTime(record),level=record.levelname,logger=record.name,
+                 request_id=record.request_id,route=record.route,message=record.getMessage())
+        if record.duration is not None:
+            d['duration_ms'] = record.duration
+        if record.exc_info:
+            d['exc'] = self.formatException(record.exc_info)
+        return json.dumps(d,ensure_ascii=False)
+
+_listener = None
+
+#Replace root handlers with a queue handler
+#level: 日志级别名称或数值; fmt: 'text'或'json'
+def setup(level=logging.INFO,fmt='text'):
+    global _listener
+    if _listener is not None:
+        return
+    if isinstance(level,str):
+        level = logging.getLevelName(level.upper())
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    q = queue.SimpleQueue()
+    handler = QueueHandler(q)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = QueueListener(q,stream,respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+#停止后台线程，写出队列中剩余的记录
+def shutdown():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       In-process metrics: counters, rate meters and latency histograms.
+#       snapshot() returns plain dicts that can be dumped as JSON.
+#History:
+#2026/10/18         First release
+
+import time
+import bisect
+from collections import deque
+
+#默认的延迟分桶上界(毫秒)
+DEFAULT_BUCKETS = (1,2,5,10,20,50,100,200,500,1000,2000,5000)
+
+#Latency histogram
+#observe()的单位为秒，内部按毫秒分桶
+class Histogram(object):
+    def __init__(self,buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self,seconds):
+        ms = seconds * 1000.0
+        self.counts[bisect.bisect_left(self.buckets,ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    #按分桶估算分位数，返回所在桶的上界
+    def quantile(self,q):
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        n = 0
+        for i,c in enumerate(self.counts):
+            n += c
+            if n >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        buckets = dict()
+        for i,c in enumerate(self.counts):
+            buckets['le_%s' % self.buckets[i] if i < len(self.buckets) else 'inf'] = c
+        return dict(count=self.count,sum_ms=round(self.sum,3),max_ms=round(self.max,3),
+                    avg_ms=round(self.sum / self.count,3) if self.count else 0,
+                    p50_ms=self.quantile(0.5),p95_ms=self.quantile(0.95),p99_ms=self.quantile(0.99),
+                    buckets=buckets)
+
+#Event counter with a per-second rate over the last `window` seconds
+class Meter(object):
+    def __init__(self,window=60):
+        self.window = window
+        self.count = 0
+        self._started = time.time()
+        #(秒,该秒内的次数)
+        self._seconds = deque()
+
+    def mark(self,n=1):
+        self.count += n
+        now = int(time.time())
+        if self._seconds and self._seconds[-1][0] == now:
+            self._seconds[-1][1] += n
+        else:
+            self._seconds.append([now,n])
+            self._trim(now)
+
+    def _trim(self,now):
+        while self._seconds and self._seconds[0][0] <= now - self.window:
+            self._seconds.popleft()
+
+    def rate(self):
+        now = int(time.time())
+        self._trim(now)
+        elapsed = min(self.window,max(time.time() - self._started,1))
+        return sum(n for s,n in self._seconds) / elapsed
+
+    def snapshot(self):
+        return dict(count=self.count,rate_per_sec=round(self.rate(),3))
+
+#name => Histogram/Meter
+_registry = dict()
+
+def histogram(name):
+    h = _registry.get(name)
+    if h is None:
+        h = _registry[name] = Histogram()
+    return h
+
+def meter(name):
+    m = _registry.get(name)
+    if m is None:
+        m = _registry[name] = Meter()
+    return m
+
+#额外的指标提供者：name => 返回dict的函数，例如连接池当前状态
+_providers = dict()
+
+def add_provider(name,func):
+    _providers[name] = func
+
+def snapshot():
+    r = dict()
+    for name in sorted(_registry.keys()):
+        r[name] = _registry[name].snapshot()
+    for name,func in _providers.items():
+        r[name] = func()
+    return r
+
+def reset():
+    _registry.clear()
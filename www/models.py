@@ -33,6 +33,8 @@ class Blog(Model):
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
     content = TextField()
+    #保存时预先渲染的HTML，旧数据由backfill.py补全
+    html_content = TextField()
     created_at = FloatField(default=time.time)
 
 class Comment(Model):
@@ -5,26 +5,35 @@
 #History:
 #2017/06/29       smile          First release
 
+import re
+import sys
+import time
+import random
 import logging
 import asyncio
+import contextlib
+import contextvars
 import aiomysql
+import metrics
+from cache import LRUCache,TTLCache
+from singleflight import SingleFlight
 
+#每条语句的日志只在DEBUG级别输出，级别关闭时不做格式化
 def log(sql,args=()):
-    logging.info('SQL: %s' % sql)
+    logging.debug('SQL: %s',sql)
 
 #Close pool
 async def destory_pool():
-    global __pool
-    __pool.close()
-    await __pool.wait_closed()
-
-#Create connect pool
-#Parameter: host,port,user,password,db,charset,autocommit
-#           maxsize,minsize,loop
-async def create_pool(loop,**kw):
-    logging.info('Create database connection pool...')
-    global __pool
-    __pool = await aiomysql.create_pool(
+    global __pool,__replicas
+    pools = [__pool] + __replicas
+    __replicas = []
+    for pool in pools:
+        pool.close()
+    for pool in pools:
+        await pool.wait_closed()
+
+async def _create_pool(loop,kw):
+    return await aiomysql.create_pool(
         host = kw.get('host', 'localhost'),
         port = kw.get('port', 3306),
         user = kw['user'],
@@ -37,41 +46,272 @@ async def create_pool(loop,**kw):
         loop = loop
     )
 
+#只读副本连接池，select在其中选择
+__replicas = []
+#round_robin: 轮流使用; least_busy: 使用正在使用连接最少的副本
+_replica_policy = 'round_robin'
+_replica_index = 0
+#某表写入后的这段时间(秒)内，读取该表的查询仍然发往主库
+#注意：写入时间只记录在当前进程中。launcher以多进程运行时，
+#写入后的下一个请求若由其他worker处理，仍可能读到副本上的旧数据；
+#需要保证读到自己写入的代码应使用use_primary()
+_read_your_writes = 0
+#table => 最近一次写入时间
+_last_writes = dict()
+_use_primary = contextvars.ContextVar('orm_use_primary',default=False)
+#等待空闲连接的最长秒数，None为一直等待
+_acquire_timeout = None
+
+#Create connect pool
+#Parameter: host,port,user,password,db,charset,autocommit
+#           maxsize,minsize,loop
+#           replicas: 只读副本列表，每项为dict，未给出的参数沿用主库配置
+#           replica_policy,read_your_writes
+async def create_pool(loop,**kw):
+    logging.info('Create database connection pool...')
+    global __pool,__replicas,_replica_policy,_read_your_writes,_acquire_timeout
+    __pool = await _create_pool(loop,kw)
+    replicas = []
+    for replica in kw.get('replicas',None) or ():
+        options = dict(kw)
+        options.update(replica)
+        logging.info('Create replica connection pool: %s:%s' % (options.get('host','localhost'),options.get('port',3306)))
+        replicas.append(await _create_pool(loop,options))
+    __replicas = replicas
+    _replica_policy = kw.get('replica_policy','round_robin')
+    _read_your_writes = kw.get('read_your_writes',0)
+    _acquire_timeout = kw.get('acquire_timeout',None)
+
+#连接池状态：大小、使用中和空闲的连接数
+def pool_stats():
+    global __pool,__replicas
+    def stats(pool):
+        return dict(maxsize=pool.maxsize,minsize=pool.minsize,size=pool.size,free=pool.freesize,in_use=pool.size - pool.freesize)
+    try:
+        primary = __pool
+    except NameError:
+        return dict()
+    return dict(primary=stats(primary),replicas=[stats(p) for p in __replicas])
+
+metrics.add_provider('db.pool',pool_stats)
+
+#SQL模板名，用于按语句类型统计延迟，如'select blogs'、'insert comments'
+def _template(sql):
+    m = _RE_WRITE_TABLE.match(sql)
+    if m:
+        return '%s %s' % (sql.split(None,1)[0].lower(),m.group(1))
+    tables = _RE_SELECT_TABLES.findall(sql)
+    return '%s %s' % (sql.split(None,1)[0].lower(),','.join(tables))
+
+#Force reads to primary
+#用法：
+#   with orm.use_primary():
+#       blog = await Blog.find(id)
+class use_primary(object):
+    def __init__(self):
+        self._token = None
+
+    def __enter__(self):
+        self._token = _use_primary.set(True)
+
+    def __exit__(self,exc_type,exc,tb):
+        _use_primary.reset(self._token)
+        return False
+
+#为SELECT选择连接池
+def _read_pool(sql):
+    global __pool,__replicas,_replica_index
+    if not __replicas or _use_primary.get():
+        return __pool
+    #读取刚写过的表时使用主库，保证读到自己的写入
+    if _read_your_writes:
+        now = time.time()
+        for table in _RE_SELECT_TABLES.findall(sql):
+            if now - _last_writes.get(table,0) < _read_your_writes:
+                return __pool
+    if _replica_policy == 'least_busy':
+        return min(__replicas,key=lambda p:p.size - p.freesize)
+    _replica_index = (_replica_index + 1) % len(__replicas)
+    return __replicas[_replica_index]
+
+#记录写入：更新最近写入时间并使查询缓存失效
+def _table_written(table):
+    _last_writes[table] = time.time()
+    if _query_cache is not None:
+        _query_cache.invalidate(table)
+
+#当前上下文(任务)中进行的事务
+_transaction = contextvars.ContextVar('orm_transaction',default=None)
+
+#调用orm的第一个外部函数，如'handlers.get_blog:95'
+#协程执行时，等待它的各层协程帧都在调用栈上
+def _caller():
+    f = sys._getframe(1)
+    while f is not None and f.f_code.co_filename == __file__:
+        f = f.f_back
+    if f is None:
+        return None
+    return '%s.%s:%s' % (f.f_globals.get('__name__'),f.f_code.co_name,f.f_lineno)
+
+#Slow query log
+#耗时超过threshold秒的语句按sample_rate抽样记录耗时、行数和调用者
+#explain=True时每种语句形态只执行一次EXPLAIN，发现全表扫描时给出警告
+class SlowQueryLog(object):
+    def __init__(self,threshold=0.1,sample_rate=1.0,explain=True,max_shapes=1000):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.explain = explain
+        self._explained = LRUCache(max_shapes)
+
+    #caller: 查询在其他task中执行(single-flight)时，由发起方预先取得的调用者
+    async def record(self,conn,sql,args,elapsed,rows,caller=None):
+        if elapsed < self.threshold:
+            return
+        metrics.meter('db.slow_queries').mark()
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        shape = ' '.join(sql.split())
+        logging.warning('slow query: %.1fms rows:%s caller:%s SQL: %s' % (elapsed * 1000,rows,caller or _caller(),shape))
+        if not self.explain or shape in self._explained or not shape[:6].upper() == 'SELECT':
+            return
+        self._explained.set(shape,True)
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute('EXPLAIN ' + sql.replace('?','%s'),args or ())
+                plan = await cur.fetchall()
+        except Exception as e:
+            logging.warning('EXPLAIN failed: %s' % e)
+            return
+        for row in plan:
+            logging.warning('EXPLAIN: %s' % dict(row))
+            if row.get('type') == 'ALL':
+                logging.warning('full table scan on `%s` (possible_keys:%s rows:%s) SQL: %s' % (row.get('table'),row.get('possible_keys'),row.get('rows'),shape))
+
+_slow_log = None
+
+#启用慢查询日志，按configs.orm.slow_query调用
+def init_slow_log(threshold=0.1,sample_rate=1.0,explain=True):
+    global _slow_log
+    _slow_log = SlowQueryLog(threshold,sample_rate,explain)
+    return _slow_log
+
+async def _select(conn,sql,args,size=None,caller=None):
+    start = time.time()
+    async with conn.cursor(aiomysql.DictCursor) as cur:
+        await cur.execute(sql.replace('?','%s'),args or ())
+        if size:
+            rs = await cur.fetchmany(size)
+        else:
+            rs = await cur.fetchall()
+    elapsed = time.time() - start
+    metrics.histogram('db.query.%s' % _template(sql)).observe(elapsed)
+    if _slow_log is not None:
+        await _slow_log.record(conn,sql,args,elapsed,len(rs),caller)
+    logging.debug('rows returned: %s',len(rs))
+    return rs
+
+async def _execute(conn,sql,args):
+    start = time.time()
+    async with conn.cursor(aiomysql.DictCursor) as cur:
+        await cur.execute(sql.replace('?','%s'),args or ())
+        rows = cur.rowcount
+    elapsed = time.time() - start
+    metrics.histogram('db.query.%s' % _template(sql)).observe(elapsed)
+    if _slow_log is not None:
+        await _slow_log.record(conn,sql,args,elapsed,rows)
+    m = _RE_WRITE_TABLE.match(sql)
+    if m:
+        _table_written(m.group(1))
+        tx = _transaction.get()
+        if tx is not None:
+            tx._written.add(m.group(1))
+    return rows
+
 #Package SELECT function that can execute SELECT command.
 #Setup 1:acquire connection from connection pool.
 #Setup 2:create a cursor to execute MySQL command.
 #Setup 3:execute MySQL command with cursor.
 #Setup 4:return query result.
-async def select(sql,args,size=None):
+#在事务中调用时使用事务的连接
+#cache=True或缓存秒数时先查查询缓存(事务中不使用缓存)
+async def select(sql,args,size=None,cache=False):
+    tx = _transaction.get()
+    cache = cache and tx is None and _query_cache is not None
+    if cache:
+        key = _query_cache.key(sql,args,size)
+        rs = _query_cache.get(key)
+        if rs is not None:
+            return rs
     log(sql,args)
-    global __pool
-    async with __pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            await cur.execute(sql.replace('?','%s'),args or ())
-            if size:
-                rs = await cur.fetchmany(size)
-            else:
-                rs = await cur.fetchall()
-
-        logging.info('rows returned: %s' % len(rs))
-        return rs
+    imap = _identity_map.get()
+    if imap is not None:
+        imap.queries += 1
+    if tx is not None:
+        return await _select(tx.conn,sql,args,size)
+    #不在事务中时，读取可以发往只读副本
+    pool = _read_pool(sql)
+    if _single_flight is not None:
+        #相同的并发查询只执行一次，各调用方得到各自的行副本
+        #键包含各表最近一次写入的时间：写入之后发起的查询不会合并到写入之前开始的查询上
+        writes = tuple(_last_writes.get(t,0) for t in _RE_SELECT_TABLES.findall(sql))
+        key = (sql,tuple(args or ()),size,pool is __pool,writes)
+        #查询在单独的task中执行，慢查询日志无法再从调用栈找到处理函数
+        caller = _caller() if _slow_log is not None else None
+        rs = [dict(r) for r in await _single_flight.do(key,_select_pool,pool,sql,args,size,caller)]
+    else:
+        rs = await _select_pool(pool,sql,args,size)
+    if cache:
+        _query_cache.set(key,rs,None if cache is True else cache)
+    return rs
+
+async def _select_pool(pool,sql,args,size=None,caller=None):
+    async with _connection(pool) as conn:
+        return await _select(conn,sql,args,size,caller)
+
+#Stream SELECT result with a server-side cursor
+#每次从服务器读取batch_size行，内存占用与结果集大小无关
+#调用方提前结束时(aclose)结果集尚未读完，直接关闭该连接而不是读完剩余数据
+async def select_iter(sql,args,batch_size=100):
+    log(sql,args)
+    imap = _identity_map.get()
+    if imap is not None:
+        imap.queries += 1
+    pool = _read_pool(sql)
+    conn = await _acquire(pool)
+    finished = False
+    try:
+        cur = await conn.cursor(aiomysql.SSDictCursor)
+        await cur.execute(sql.replace('?','%s'),args or ())
+        while True:
+            rs = await cur.fetchmany(batch_size)
+            if not rs:
+                break
+            for r in rs:
+                yield r
+        await cur.close()
+        finished = True
+    finally:
+        if not finished:
+            conn.close()
+        _release(conn,pool)
 
 #Package execute function that can execute INSERT,UPDATE and DELETE command
+#在事务中调用时使用事务的连接，由事务统一提交
 async def execute(sql,args,autocommit=True):
-    global __pool
+    tx = _transaction.get()
+    if tx is not None:
+        return await _execute(tx.conn,sql,args)
     #acquire connection from connection pool
-    async with __pool.acquire() as conn:
+    async with _connection() as conn:
         #如果MySQL禁止隐式提交，则标记事务开始
         if not autocommit:
             await conn.begin()
         try:
             #create cursor to execute MySQL command
-            async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(sql.replace('?','%s'),args or ())
-                affectrow = cur.rowcount
-                #如果MySQL禁止隐式提交，手动提交事务
-                if not autocommit:
-                    await cur.commit()
+            affectrow = await _execute(conn,sql,args)
+            #如果MySQL禁止隐式提交，手动提交事务
+            if not autocommit:
+                await conn.commit()
         #如果事务处理出现错误，则回退
         except BaseException as e:
             await conn.rollback()
@@ -80,6 +320,267 @@ async def execute(sql,args,autocommit=True):
         #return number of affected rows
         return affectrow
 
+#Execute several statements on one connection inside one transaction
+#statements: iterable of (sql,args)
+#返回每条语句影响的行数；任何一条失败则全部回退
+async def execute_batch(statements):
+    rows = []
+    async with transaction() as tx:
+        for sql,args in statements:
+            log(sql,args)
+            rows.append(await tx.execute(sql,args))
+    return rows
+
+#Transaction
+#一个事务固定使用连接池中的一条连接
+#事务中的写操作监听通知推迟到提交之后，回退时丢弃
+class Transaction(object):
+    def __init__(self,conn):
+        self.conn = conn
+        self._pending = []
+        self._written = set()
+
+    async def select(self,sql,args,size=None):
+        return await _select(self.conn,sql,args,size)
+
+    async def execute(self,sql,args):
+        return await _execute(self.conn,sql,args)
+
+    #Model的写操作在事务上下文中自动使用事务连接
+    async def save(self,model):
+        await model.save()
+
+    async def update(self,model):
+        await model.update()
+
+    async def remove(self,model):
+        await model.remove()
+
+#Transaction context manager
+#用法：
+#   async with orm.transaction() as tx:
+#       await tx.save(comment)
+#       await tx.execute('UPDATE ...',args)
+#块内的select/execute以及Model.find/save/update/remove都使用同一连接，
+#正常退出时提交一次，出现异常时回退；嵌套使用时并入外层事务
+class transaction(object):
+    def __init__(self):
+        self._tx = None
+        self._token = None
+
+    async def __aenter__(self):
+        tx = _transaction.get()
+        if tx is not None:
+            return tx
+        conn = await _acquire()
+        try:
+            await conn.begin()
+        except BaseException:
+            _release(conn)
+            raise
+        self._tx = Transaction(conn)
+        self._token = _transaction.set(self._tx)
+        return self._tx
+
+    async def __aexit__(self,exc_type,exc,tb):
+        #嵌套事务由外层负责提交
+        if self._tx is None:
+            return False
+        tx = self._tx
+        _transaction.reset(self._token)
+        try:
+            if exc_type is None:
+                await tx.conn.commit()
+            else:
+                await tx.conn.rollback()
+        finally:
+            _release(tx.conn)
+        #提交前其他连接可能已把旧数据重新放入缓存，提交后再记录一次
+        for table in tx._written:
+            _table_written(table)
+        if exc_type is None:
+            for table,action,model in tx._pending:
+                _notify(table,action,model)
+        return False
+
+#Acquire a connection, primary pool by default
+#记录等待时间、获取次数和超时次数
+async def _acquire(pool=None):
+    global __pool
+    pool = pool or __pool
+    start = time.time()
+    try:
+        if _acquire_timeout:
+            conn = await asyncio.wait_for(pool.acquire(),_acquire_timeout)
+        else:
+            conn = await pool.acquire()
+    except asyncio.TimeoutError:
+        metrics.meter('db.acquire.timeouts').mark()
+        logging.warning('timeout acquiring connection after %ss' % _acquire_timeout)
+        raise
+    metrics.histogram('db.acquire.wait').observe(time.time() - start)
+    metrics.meter('db.acquire').mark()
+    return conn
+
+def _release(conn,pool=None):
+    global __pool
+    (pool or __pool).release(conn)
+
+@contextlib.asynccontextmanager
+async def _connection(pool=None):
+    conn = await _acquire(pool)
+    try:
+        yield conn
+    finally:
+        _release(conn,pool)
+
+#Query result cache
+#缓存键：规范化的SQL + 参数 + 所涉及各表的版本号
+#写入某表时该表版本号加一，旧缓存不再被命中，随后由LRU淘汰
+#缓存的是原始行，每次返回新的dict，调用方修改结果不会影响缓存
+_RE_SELECT_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?',re.IGNORECASE)
+_RE_WRITE_TABLE = re.compile(r'^\s*(?:INSERT(?:\s+INTO)?|REPLACE(?:\s+INTO)?|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?',re.IGNORECASE)
+
+#max_bytes: 按估计的结果大小限制缓存占用的内存
+class QueryCache(object):
+    def __init__(self,size=1000,ttl=10,max_rows=1000,max_bytes=None):
+        self.max_rows = max_rows
+        self._cache = TTLCache(size,ttl,max_bytes)
+        self._versions = dict()
+
+    #须在执行查询之前取得键：查询期间发生的写入使版本号增加，
+    #结果存放在旧版本的键下，不会再被命中
+    def key(self,sql,args,size=None):
+        sql = ' '.join(sql.split())
+        tables = sorted(set(_RE_SELECT_TABLES.findall(sql)))
+        return (sql,tuple(args or ()),size,tuple((t,self._versions.get(t,0)) for t in tables))
+
+    def get(self,key):
+        rs = self._cache.get(key)
+        if rs is None:
+            return None
+        return [dict(r) for r in rs]
+
+    def set(self,key,rs,ttl=None):
+        if len(rs) > self.max_rows:
+            return
+        self._cache.set(key,tuple(dict(r) for r in rs),ttl,_sizeof(key,rs))
+
+    def invalidate(self,table):
+        self._versions[table] = self._versions.get(table,0) + 1
+
+    def clear(self):
+        self._cache.clear()
+
+    def __str__(self):
+        return str(self._cache)
+
+    __repr__ = __str__
+
+#估计一个缓存条目占用的字节数：字符串按长度计，其他值按固定开销计
+def _sizeof(key,rs):
+    n = len(key[0])
+    for r in rs:
+        for v in r.values():
+            n += 64 + (len(v) if isinstance(v,(str,bytes)) else 0)
+    return n
+
+_query_cache = None
+
+#启用查询缓存，create_pool时按configs.orm.query_cache调用
+def init_query_cache(size=1000,ttl=10,max_rows=1000,max_bytes=None):
+    global _query_cache
+    _query_cache = QueryCache(size,ttl,max_rows,max_bytes)
+    return _query_cache
+
+def query_cache():
+    return _query_cache
+
+_single_flight = None
+
+#启用查询合并，按configs.orm.single_flight调用
+def init_single_flight():
+    global _single_flight
+    _single_flight = SingleFlight('db.select')
+    return _single_flight
+
+#Identity map
+#在一次请求内按(表名,主键)记住已加载的Model实例，
+#Model.find命中时直接返回同一实例，不再查询数据库
+#queries: 该范围内实际执行的查询数；hits: 由identity map直接返回的次数
+class IdentityMap(object):
+    def __init__(self):
+        self._objects = dict()
+        self.queries = 0
+        self.hits = 0
+
+    def get(self,cls,pk):
+        return self._objects.get((cls.__table__,pk))
+
+    def add(self,model):
+        self._objects[(model.__table__,model.getValue(model.__primary_key__))] = model
+
+    def discard(self,model):
+        self._objects.pop((model.__table__,model.getValue(model.__primary_key__)),None)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __str__(self):
+        return 'objects:%s,queries:%s,hits:%s' % (len(self._objects),self.queries,self.hits)
+
+    __repr__ = __str__
+
+_identity_map = contextvars.ContextVar('orm_identity_map',default=None)
+
+#Identity map context manager
+#用法：
+#   with orm.identity_map() as imap:
+#       ...
+#只在with块(及其中创建的任务)内生效，不使用时行为与之前相同
+class identity_map(object):
+    def __init__(self):
+        self._token = None
+
+    def __enter__(self):
+        imap = IdentityMap()
+        self._token = _identity_map.set(imap)
+        return imap
+
+    def __exit__(self,exc_type,exc,tb):
+        _identity_map.reset(self._token)
+        return False
+
+def current_identity_map():
+    return _identity_map.get()
+
+#写操作监听器：table => [callback(action,model)]
+#Model.save/update/remove成功后依次调用，action为'insert','update','delete'
+#用于清除依赖该表的缓存
+_listeners = dict()
+
+def add_listener(table,callback):
+    _listeners.setdefault(table,[]).append(callback)
+
+def remove_listener(table,callback):
+    L = _listeners.get(table,[])
+    if callback in L:
+        L.remove(callback)
+
+def _notify(table,action,model=None):
+    for callback in list(_listeners.get(table,())):
+        try:
+            callback(action,model)
+        except Exception as e:
+            logging.exception(e)
+
+def notify(table,action,model=None):
+    tx = _transaction.get()
+    if tx is not None:
+        tx._pending.append((table,action,model))
+    else:
+        _notify(table,action,model)
+
 #Create placeholder with '?'
 def create_args_string(num):
     L = []
@@ -87,6 +588,21 @@ def create_args_string(num):
         L.append('?')
     return ', '.join(L)
 
+#Create seek condition for keyset pagination
+#(a,b) < (x,y)  =>  `a` < x OR (`a` = x AND `b` < y)
+#展开成OR形式，MySQL可以使用(a,b)上的索引做范围扫描
+def seek_clause(columns,values,op):
+    if len(columns) != len(values):
+        raise ValueError('keyset %s does not match values %s' % (str(columns),str(values)))
+    clauses = []
+    args = []
+    for i,col in enumerate(columns):
+        parts = list(map(lambda c:'`%s` = ?' % c,columns[:i]))
+        parts.append('`%s` %s ?' % (col,op))
+        clauses.append('(%s)' % ' AND '.join(parts))
+        args.extend(values[:i + 1])
+    return ' OR '.join(clauses),args
+
 #A base class about Field
 #描述字段的字段名，数据类型，键信息，默认值
 class Field(object):
@@ -219,18 +735,53 @@ class Model(dict,metaclass=ModelMetaclass):
 
     #ORM框架下，每条记录作为对象返回
     #@classmethod定义类方法，类对象cls便可完成某些操作
+    #
+    #cache=True或缓存秒数：结果放入查询缓存，写入该表时自动失效
+    #
+    #seek分页(keyset pagination)：
+    #   keyset=('created_at','id')    有索引的排序列，最后一列须唯一
+    #   after=(v1,v2) / before=(v1,v2) 从该位置之后/之前开始取
+    #   desc=True                     排序方向
+    #不使用OFFSET，深页和浅页一样快；before方向的结果同样按正常顺序返回
+    #
+    #columns=(...)：只查询这些列，用于列表等不需要大字段的场合
+    #   返回的是不完整的记录，不放入identity map，也不应save/update
     @classmethod
     async def findAll(cls,where=None,args=None,**kw):
-        sql = [cls.__select__]
+        columns = kw.get('columns',None)
+        if columns is None:
+            sql = [cls.__select__]
+        else:
+            sql = ['SELECT %s FROM `%s`' % (','.join(map(lambda f:'`%s`' % f,columns)),cls.__table__)]
+        args = [] if args is None else list(args)
+        conditions = [where] if where else []
+
+        orderby = kw.get('orderBy',None) or kw.get('orderby',None)
+        keyset = kw.get('keyset',None)
+        reverse = False
+        if keyset:
+            desc = kw.get('desc',True)
+            after = kw.get('after',None)
+            before = kw.get('before',None)
+            #向前翻页时反向排序取数，再把结果倒回来
+            reverse = before is not None
+            if after is not None:
+                clause,seek_args = seek_clause(keyset,after,'<' if desc else '>')
+            elif before is not None:
+                clause,seek_args = seek_clause(keyset,before,'>' if desc else '<')
+            else:
+                clause,seek_args = None,[]
+            if clause:
+                conditions.append(clause)
+                args.extend(seek_args)
+            direction = 'DESC' if desc != reverse else 'ASC'
+            orderby = ', '.join(map(lambda k:'`%s` %s' % (k,direction),keyset))
+
         #添加WHERE子句
-        if where:
+        if conditions:
             sql.append('WHERE')
-            sql.append(where)
-
-        if args is None:
-            args = []
+            sql.append(' AND '.join(map(lambda c:'(%s)' % c,conditions)) if len(conditions) > 1 else conditions[0])
 
-        orderby = kw.get('orderby',None)
         #添加ORDER BY子句
         if orderby:
             sql.append('ORDER BY')
@@ -250,11 +801,47 @@ class Model(dict,metaclass=ModelMetaclass):
                 raise ValueError('Invalid limit value: %s' % str(limit))
 
         #execute SQL
-        rs = await select(' '.join(sql),args)
+        #cache=True或缓存秒数时使用查询缓存
+        rs = await select(' '.join(sql),args,cache=kw.get('cache',False))
+        if reverse:
+            rs = list(reversed(rs))
         #将每条记录作为对象返回
-        return [cls(**r) for r in rs]
+        imap = _identity_map.get()
+        if imap is None or columns is not None:
+            return [cls(**r) for r in rs]
+        #已加载过的记录返回identity map中的实例
+        L = []
+        for r in rs:
+            obj = imap.get(cls,r.get(cls.__primary_key__))
+            if obj is None:
+                obj = cls(**r)
+                imap.add(obj)
+            L.append(obj)
+        return L
+
+    #逐条返回记录的异步生成器，用于导出、回填等遍历整表的任务
+    #用法：
+    #   async with contextlib.aclosing(Blog.iterate()) as blogs:
+    #       async for blog in blogs:
+    #           ...
+    #使用aclosing保证提前break时连接被及时释放
+    @classmethod
+    async def iterate(cls,where=None,args=None,batch_size=100,**kw):
+        sql = [cls.__select__]
+        if where:
+            sql.append('WHERE')
+            sql.append(where)
+        orderby = kw.get('orderBy',None) or kw.get('orderby',None)
+        if orderby:
+            sql.append('ORDER BY')
+            sql.append(orderby)
+        rows = select_iter(' '.join(sql),args,batch_size)
+        try:
+            async for r in rows:
+                yield cls(**r)
+        finally:
+            await rows.aclose()
 
-    
     #过滤结果数量
     @classmethod
     async def findNumber(cls,selectField,where=None,args=None):
@@ -273,10 +860,19 @@ class Model(dict,metaclass=ModelMetaclass):
     #返回主键的一条记录
     @classmethod
     async def find(cls,pk):
+        imap = _identity_map.get()
+        if imap is not None:
+            obj = imap.get(cls,pk)
+            if obj is not None:
+                imap.hits += 1
+                return obj
         rs = await select('%s WHERE `%s` = ?' % (cls.__select__,cls.__primary_key__),[pk],1)
         if len(rs) == 0:
             return None
-        return cls(**rs[0])
+        obj = cls(**rs[0])
+        if imap is not None:
+            imap.add(obj)
+        return obj
 
     #INSERT command
     async def save(self):
@@ -285,6 +881,34 @@ class Model(dict,metaclass=ModelMetaclass):
         rows = await execute(self.__insert__,args)
         if rows != 1:
             logging.warn('Faield to insert record:affected rows: %s' % rows)
+        imap = _identity_map.get()
+        if imap is not None:
+            imap.add(self)
+        notify(self.__table__,'insert',self)
+
+    #Bulk INSERT command
+    #每chunk_size条记录合并为一条多行INSERT ... VALUES (...),(...)
+    #所有分块在同一连接、同一事务中写入，返回每个分块影响的行数
+    @classmethod
+    async def save_many(cls,models,chunk_size=500):
+        models = list(models)
+        if not models:
+            return []
+        statements = []
+        for i in range(0,len(models),chunk_size):
+            chunk = models[i:i + chunk_size]
+            args = []
+            for m in chunk:
+                args.extend(map(m.getValueorDefault,cls.__fields__))
+                args.append(m.getValueorDefault(cls.__primary_key__))
+            sql = cls.__insert__ + (', (%s)' % create_args_string(len(cls.__fields__) + 1)) * (len(chunk) - 1)
+            statements.append((sql,args))
+        rows = await execute_batch(statements)
+        if sum(rows) != len(models):
+            logging.warn('Faield to insert records:affected rows: %s of %s' % (sum(rows),len(models)))
+        for m in models:
+            notify(cls.__table__,'insert',m)
+        return rows
 
     #UPDATE command
     async def update(self):
@@ -293,6 +917,10 @@ class Model(dict,metaclass=ModelMetaclass):
         rows = await execute(self.__update__,args)
         if rows != 1:
             logging.warn('Faield to update by primary_key:affectesd rows: %s' % rows)
+        imap = _identity_map.get()
+        if imap is not None:
+            imap.add(self)
+        notify(self.__table__,'update',self)
 
     #DELETE command
     async def remove(self):
@@ -300,3 +928,7 @@ class Model(dict,metaclass=ModelMetaclass):
         rows = await execute(self.__delete__,args)
         if rows != 1:
             logging.warn('Faield to remove by primary key:affected: %s' % rows)
+        imap = _identity_map.get()
+        if imap is not None:
+            imap.discard(self)
+        notify(self.__table__,'delete',self)
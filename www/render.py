@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Markdown rendering with an LRU cache in front of markdown2.
+#       Large documents are converted in a process pool so the event loop
+#       is not blocked.
+#History:
+#2026/10/18         First release
+
+import asyncio
+import hashlib
+import markdown2
+from concurrent.futures import ProcessPoolExecutor
+from cache import LRUCache
+from config import configs
+
+_cache = LRUCache(configs.markdown.cache_size)
+_executor = None
+
+#缓存键：SHA1(内容 + extras)
+#extras可以是list或dict，排序后参与哈希，保证相同配置得到相同的键
+def _cache_key(text,extras=None):
+    h = hashlib.sha1(text.encode('utf-8'))
+    if extras:
+        if isinstance(extras,dict):
+            extras = ['%s=%r' % (k,v) for k,v in extras.items()]
+        h.update(('\0%s' % ','.join(sorted(extras))).encode('utf-8'))
+    return h.hexdigest()
+
+#在子进程中执行转换，返回普通str以便跨进程传递
+def _convert(text,extras=None):
+    return str(markdown2.markdown(text,extras=extras))
+
+#进程池在第一次使用时创建，每个进程各自持有
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=configs.markdown.workers or None)
+    return _executor
+
+#关闭进程池
+def shutdown(wait=True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+#Markdown to HTML (async)
+#小于inline_max_size的文本直接在当前线程转换，避免进程间通信的开销
+async def render_markdown(text,extras=None):
+    key = _cache_key(text,extras)
+    html = _cache.get(key)
+    if html is None:
+        if len(text) < configs.markdown.inline_max_size:
+            html = _convert(text,extras)
+        else:
+            loop = asyncio.get_event_loop()
+            html = await loop.run_in_executor(_get_executor(),_convert,text,extras)
+        _cache.set(key,html)
+    return html
+
+#内容修改或删除时清除对应的缓存
+def invalidate(text,extras=None):
+    if text:
+        _cache.pop(_cache_key(text,extras))
@@ -13,7 +13,7 @@ create table users(
     `image` varchar(500) not null,
     `created_at` real not null,
     unique key `idx_email` (`email`),
-    key `idx_created_at` (`created_at`),
+    key `idx_created_at` (`created_at`,`id`),
     primary key (`id`)
 )engine=innodb default charset=utf8;
 
@@ -25,11 +25,16 @@ create table blogs(
     `name` varchar(50) not null,
     `summary` varchar(200) not null,
     `content` mediumtext not null,
+    `html_content` mediumtext,
     `created_at` real not null,
-    key `idx_created_at` (`created_at`),
+    key `idx_created_at` (`created_at`,`id`),
     primary key (`id`)
 )engine=innodb default charset=utf8;
 
+-- existing databases:
+-- alter table blogs add column `html_content` mediumtext after `content`;
+-- then run `python3 backfill.py` to render existing posts.
+
 create table comments(
     `id` varchar(50) not null,
     `blog_id` varchar(50) not null,
@@ -38,6 +43,10 @@ create table comments(
     `user_image` varchar(500) not null,
     `content` mediumtext not null,
     `created_at` real not null,
-    key `idx_created_at` (`created_at`),
+    key `idx_created_at` (`created_at`,`id`),
+    key `idx_blog_id` (`blog_id`,`created_at`),
     primary key (`id`)
 )engine=innodb default charset=utf8;
+
+-- existing databases:
+-- alter table comments add key `idx_blog_id` (`blog_id`,`created_at`);
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Request coalescing (single-flight): concurrent calls with the same
+#       key share one in-flight task instead of each doing the work.
+#History:
+#2026/10/18         First release
+
+import asyncio
+import metrics
+
+class SingleFlight(object):
+    def __init__(self,name):
+        self.name = name
+        #key => 进行中的task
+        self._calls = dict()
+
+    #第一个调用者创建task，其后相同key的调用者等待同一个task
+    #task独立于调用者运行，某个调用者被取消不会影响其他等待者
+    async def do(self,key,func,*args,**kw):
+        task = self._calls.get(key)
+        if task is None:
+            metrics.meter('singleflight.%s.calls' % self.name).mark()
+            task = asyncio.ensure_future(func(*args,**kw))
+            self._calls[key] = task
+            task.add_done_callback(lambda t:self._done(key,t))
+        else:
+            metrics.meter('singleflight.%s.shared' % self.name).mark()
+        return (await asyncio.shield(task))
+
+    def _done(self,key,task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        #所有等待者都已取消时，避免"exception was never retrieved"警告
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self):
+        return len(self._calls)
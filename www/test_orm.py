@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Program:
+#       Tests for read/write routing between the primary and replicas.
+#       Connection pools are replaced by in-memory stand-ins that record
+#       which pool each statement was sent to.
+#Usage:
+#       python3 -m unittest test_orm
+#History:
+#2026/10/18         First release
+
+import time
+import unittest
+from unittest import mock
+import orm
+
+class FakeCursor(object):
+    def __init__(self,conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,exc_type,exc,tb):
+        return False
+
+    async def execute(self,sql,args):
+        self.conn.pool.log.append((self.conn.pool.name,sql.split(None,1)[0].upper()))
+        self.rowcount = 1
+
+    async def fetchall(self):
+        return []
+
+    async def fetchmany(self,size):
+        return []
+
+class FakeConnection(object):
+    def __init__(self,pool):
+        self.pool = pool
+
+    def cursor(self,*args):
+        return FakeCursor(self)
+
+    async def begin(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+class FakePool(object):
+    def __init__(self,name,log):
+        self.name = name
+        self.log = log
+        self.maxsize = self.minsize = self.size = 1
+        self.freesize = 1
+
+    async def acquire(self):
+        return FakeConnection(self)
+
+    def release(self,conn):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+class ReplicaRoutingTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.log = []
+        async def create_pool(**kw):
+            return FakePool(kw['host'],self.log)
+        with mock.patch.object(orm.aiomysql,'create_pool',create_pool):
+            await orm.create_pool(loop=None,host='primary',user='u',password='p',db='d',
+                                  replicas=[dict(host='replica1'),dict(host='replica2')],read_your_writes=5)
+        orm._last_writes.clear()
+
+    async def asyncTearDown(self):
+        orm._last_writes.clear()
+        await orm.destory_pool()
+
+    def pools(self):
+        pools = [name for name,verb in self.log]
+        del self.log[:]
+        return pools
+
+    async def test_reads_go_to_replicas(self):
+        await orm.select('SELECT * FROM `blogs`',[])
+        await orm.select('SELECT * FROM `blogs`',[])
+        self.assertEqual(sorted(self.pools()),['replica1','replica2'])
+
+    async def test_writes_go_to_primary(self):
+        await orm.execute('INSERT INTO `blogs` (`id`) VALUES (?)',['1'])
+        await orm.execute('UPDATE `users` SET `name`=? WHERE `id`=?',['a','1'])
+        self.assertEqual(self.pools(),['primary','primary'])
+
+    async def test_transaction_uses_primary(self):
+        async with orm.transaction() as tx:
+            await orm.select('SELECT * FROM `users`',[])
+            await tx.execute('INSERT INTO `comments` (`id`) VALUES (?)',['1'])
+        self.assertEqual(self.pools(),['primary','primary'])
+
+    async def test_read_your_writes_window(self):
+        await orm.execute('INSERT INTO `blogs` (`id`) VALUES (?)',['1'])
+        self.pools()
+        #刚写过的表读主库，其他表仍读副本
+        await orm.select('SELECT * FROM `blogs`',[])
+        await orm.select('SELECT * FROM `users`',[])
+        pools = self.pools()
+        self.assertEqual(pools[0],'primary')
+        self.assertIn(pools[1],('replica1','replica2'))
+        #窗口过后恢复读副本
+        orm._last_writes['blogs'] = time.time() - 10
+        await orm.select('SELECT * FROM `blogs`',[])
+        self.assertNotEqual(self.pools()[0],'primary')
+
+    async def test_use_primary(self):
+        with orm.use_primary():
+            await orm.select('SELECT * FROM `blogs`',[])
+        self.assertEqual(self.pools(),['primary'])
+
+if __name__ == '__main__':
+    unittest.main()